@@ -0,0 +1,73 @@
+"""Compare the protocol callback registry with the plain list it replaced.
+
+Usage: python -m benchmarks.callback_registry [registered_callbacks]
+
+Measures dispatching one frame to every registered callback, and the churn of
+one-shot callbacks (add then remove) while the others stay registered.
+"""
+import timeit
+from itertools import islice
+from sys import argv
+
+from flist.chat.callbacks import CallbackList
+
+
+def noop(message):
+    pass
+
+
+def list_dispatch(callbacks, message):
+    for f in callbacks.copy():
+        f(message)
+
+
+def registry_dispatch(callbacks, message):
+    try:
+        for f in islice(callbacks.slots, callbacks.begin()):
+            if f is not None:
+                f(message)
+    finally:
+        callbacks.end()
+
+
+def main():
+    registered = int(argv[1]) if len(argv) > 1 else 5000
+    functions = [lambda message: None for _ in range(registered)]
+    message = {'character': "Hexxy"}
+
+    plain = list(functions)
+    registry = CallbackList()
+    for f in functions:
+        registry.add(f)
+
+    def list_churn():
+        plain.append(noop)
+        plain.remove(noop)
+
+    def registry_churn():
+        registry.add(noop).remove()
+
+    middle = functions[registered // 2]
+
+    def list_remove_middle():
+        plain.remove(middle)
+        plain.append(middle)
+
+    def registry_remove_middle():
+        registry.remove(middle)
+        registry.add(middle)
+
+    cases = [
+        ("dispatch", lambda: list_dispatch(plain, message), lambda: registry_dispatch(registry, message), 200),
+        ("one-shot add/remove", list_churn, registry_churn, 2000),
+        ("remove by function", list_remove_middle, registry_remove_middle, 2000),
+    ]
+    print("%d registered callbacks" % registered)
+    for label, old, new, number in cases:
+        old_time = min(timeit.repeat(old, number=number, repeat=5)) / number
+        new_time = min(timeit.repeat(new, number=number, repeat=5)) / number
+        print("%-20s list %9.2f us   registry %9.2f us" % (label, old_time * 1e6, new_time * 1e6))
+
+
+if __name__ == '__main__':
+    main()
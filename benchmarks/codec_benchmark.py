@@ -0,0 +1,65 @@
+"""Compare the JSON codec backends on chat traffic.
+
+Usage: python -m benchmarks.codec_benchmark [recorded_traffic.txt]
+
+The recording is a text file with one raw frame per line, such as "MSG {...}".
+Without a recording a synthetic sample shaped like a busy evening on the
+public server is used.
+"""
+import json
+import random
+import timeit
+from sys import argv
+
+from flist.codec import available_codecs
+
+genders = ["Male", "Female", "Transgender", "Herm", "Shemale", "Male-Herm", "Cunt-boy", "None"]
+statuses = ["online", "looking", "busy", "away", "dnd"]
+
+
+def synthetic_traffic(characters=20000, chatter=5000):
+    random.seed(1)
+    names = ["Character %d" % i for i in range(characters)]
+    frames = []
+    for chunk in range(0, characters, 100):
+        lis = [[n, random.choice(genders), random.choice(statuses), "Status message " * 3]
+               for n in names[chunk:chunk + 100]]
+        frames.append("LIS " + json.dumps({'characters': lis}))
+    for _ in range(chatter):
+        name = random.choice(names)
+        kind = random.random()
+        if kind < 0.3:
+            frames.append("STA " + json.dumps({'character': name, 'status': random.choice(statuses),
+                                               'statusmsg': "Looking for a story"}))
+        elif kind < 0.6:
+            frames.append("TPN " + json.dumps({'character': name, 'status': 'typing'}))
+        elif kind < 0.8:
+            frames.append("NLN " + json.dumps({'identity': name, 'gender': random.choice(genders),
+                                               'status': 'online'}))
+        else:
+            frames.append("MSG " + json.dumps({'character': name, 'channel': 'Frontpage',
+                                               'message': "Evening everyone, " * random.randint(1, 20)}))
+    return frames
+
+
+def load_traffic(path):
+    with open(path, encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f if len(line) > 4]
+
+
+def main():
+    frames = load_traffic(argv[1]) if len(argv) > 1 else synthetic_traffic()
+    payloads = [frame[4:] for frame in frames]
+    objects = [json.loads(p) for p in payloads]
+    size = sum(len(p) for p in payloads)
+    print("%d frames, %.1f MiB of JSON" % (len(frames), size / 2 ** 20))
+
+    for codec in available_codecs():
+        loads = min(timeit.repeat(lambda: [codec.loads(p) for p in payloads], number=1, repeat=5))
+        dumps = min(timeit.repeat(lambda: [codec.dumps(o) for o in objects], number=1, repeat=5))
+        print("%-8s loads %8.1f ms (%6.1f MiB/s)   dumps %8.1f ms" % (
+            codec.name, loads * 1000, size / 2 ** 20 / loads, dumps * 1000))
+
+
+if __name__ == '__main__':
+    main()
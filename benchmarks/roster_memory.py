@@ -0,0 +1,96 @@
+"""Measure the memory held per online character.
+
+Usage: python -m benchmarks.roster_memory [online_characters]
+
+"before" models what bots kept without the roster: a dict based Character
+holding its own copy of the name and a protocol reference, plus a status dict
+per character, and names repeated in channel member lists.
+"after" is the Connection roster with a shared Character per name, fed the
+same LIS frames and the same channel lists.
+"""
+import gc
+import json
+import random
+import tracemalloc
+from sys import argv
+
+from flist.codec import get_codec
+from flist.fchat import CharacterRegistry
+from flist.roster import Roster
+
+genders = ["Male", "Female", "Transgender", "Herm", "Shemale", "Male-Herm", "Cunt-boy", "None"]
+statuses = ["online", "looking", "busy", "away", "dnd"]
+
+
+class LegacyCharacter:
+    def __init__(self, protocol, name):
+        self.name = str(name)
+        self.protocol = protocol
+
+
+class FakeChat(object):
+    protocol = None
+
+    def __init__(self):
+        self.roster = Roster()
+
+
+def frames(characters):
+    random.seed(1)
+    lis = []
+    for i in range(0, characters, 100):
+        chunk = [["Character %d" % n, random.choice(genders), random.choice(statuses),
+                  random.choice(["", "", "Looking for a story"])]
+                 for n in range(i, min(i + 100, characters))]
+        lis.append("LIS " + json.dumps({'characters': chunk}))
+    # Every character shows up in a few channel member lists, decoded from separate frames.
+    ich = ["ICH " + json.dumps({'users': [{'identity': "Character %d" % n}
+                                          for n in random.sample(range(characters), characters // 10)]})
+           for _ in range(20)]
+    return lis, ich
+
+
+def measure(build, lis, ich):
+    codec = get_codec()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    held = build([codec.loads(f[4:]) for f in lis], [codec.loads(f[4:]) for f in ich])
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del held
+    return size
+
+
+def legacy(lis, ich):
+    characters = {}
+    statuses_ = {}
+    for message in lis:
+        for name, gender, status, statusmsg in message['characters']:
+            characters[name] = LegacyCharacter(object, name)
+            statuses_[name] = {'gender': gender, 'status': status, 'statusmsg': statusmsg}
+    members = [[u['identity'] for u in message['users']] for message in ich]
+    return characters, statuses_, members
+
+
+def compact(lis, ich):
+    chat = FakeChat()
+    registry = CharacterRegistry(chat)
+    for message in lis:
+        chat.roster.on_list(message)
+    members = [[registry[u['identity']] for u in message['users']] for message in ich]
+    return chat, registry, members
+
+
+def main():
+    online = int(argv[1]) if len(argv) > 1 else 30000
+    lis, ich = frames(online)
+    for label, build in (("before", legacy), ("after", compact)):
+        size = measure(build, lis, ich)
+        print("%-6s %8.1f bytes per online character (%.1f MiB)" % (label, size / online, size / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
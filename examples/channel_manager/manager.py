@@ -1,12 +1,13 @@
 import logging
-from flist import account_login, start_chat, opcode
+from flist import account_login, start_chat, opcode, api
+from flist.chat.offload import offload
 import asyncio
 from jinja2 import Template
 
 logger = logging.getLogger('channel_manager')
 logging.getLogger('').setLevel('DEBUG')
 for name in ["FLN", "STA", "NLN"]:
-    logging.getLogger("flist.fchat." + name).setLevel('WARN')
+    logging.getLogger("flist.chat.protocol." + name).setLevel('WARN')
 template = Template(open("template.j2").read())
 
 """
@@ -17,28 +18,31 @@ In the case of this bot, users can tell it to add them or remove them from the t
 
 users_in_topics = {}
 
+# Rendering happens in a worker thread, so the event loop keeps answering pings meanwhile.
+render_topic = offload(lambda context: template.render(**context), limit=2)
 
-def topic_applicator(channel, character, message):
+
+async def topic_applicator(channel, character, message):
     global users_in_topics
     try:
         if message == "!add":
             users = users_in_topics.setdefault(channel.name, [])
             users.append(character)
             # Add the user to the topic.
-            channel.set_description(template.render(
+            channel.set_description(await render_topic(dict(
                 channel=channel.title,
-                channel_users=users,
+                channel_users=list(users),
                 channel_operators=channel.operators
-            ))
+            )))
         elif message == "!remove":
             # Remove the user from the topic.
             users = users_in_topics.setdefault(channel.name, [])
             users.remove(character)
-            channel.set_description(template.render(
+            channel.set_description(await render_topic(dict(
                 channel=channel.title,
-                channel_users=users,
+                channel_users=list(users),
                 channel_operators=channel.operators
-            ))
+            )))
         elif message == "!terminate":
             channel.set_description(channel.saved_topic)
             channel.send("I am leaving now, the example has concluded, I have restored the topic to it's previous glory.")
@@ -100,4 +104,7 @@ if __name__ == '__main__':
     account = argv[1]
     character_name = argv[3]
     asyncio.ensure_future(connect(account, argv[2], character_name))
-    asyncio.get_event_loop().run_forever()
+    try:
+        asyncio.get_event_loop().run_forever()
+    finally:
+        asyncio.get_event_loop().run_until_complete(api.close())
@@ -1,5 +1,5 @@
 import logging
-from flist import account_login, start_chat
+from flist import account_login, start_chat, api
 import asyncio
 import random
 import re
@@ -52,4 +52,7 @@ if __name__ == '__main__':
     logger.setLevel(logging.INFO)
     from sys import argv
     asyncio.ensure_future(connect(argv[1], argv[2], argv[3]))
-    asyncio.get_event_loop().run_forever()
+    try:
+        asyncio.get_event_loop().run_forever()
+    finally:
+        asyncio.get_event_loop().run_until_complete(api.close())
@@ -2,7 +2,7 @@ import asyncio
 import logging
 from sys import argv
 
-from flist import account_login, start_chat, opcode
+from flist import account_login, start_chat, opcode, api
 
 logger = logging.getLogger('status_watcher')
 logging.getLogger('').setLevel('DEBUG')
@@ -25,7 +25,10 @@ async def status_logger():
     chat = await connect(argv[1], argv[2], argv[3])
     logger.info("Attaching log_status method.")
     status_provider = chat.watch(opcode.STATUS)
-    await log_status_async(status_provider)
+    try:
+        await log_status_async(status_provider)
+    finally:
+        await api.close()
 
 
 if __name__ == '__main__':
@@ -1,28 +1,31 @@
 from flist.chat import opcode
 
 
-def account_login(account, password):
+def account_login(account, password, tickets=None):
     """Log in to an f-list account.
     :param account: F-list account name.
     :param password: Password for the account.
+    :param tickets: flist.tickets.TicketStore to reuse tickets from, such as one shared by the processes of a host.
     """
     from flist.account import Account
-    account = Account(account, password)
+    account = Account(account, password, tickets)
     return account.login()
 
 
-def start_chat(character, url="wss://chat.f-list.net/chat2"):
+def start_chat(character, url="wss://chat.f-list.net/chat2", codec=None, reconnect=False):
     """Start an instance of fchat using the specified character.
     :param character: Character instance
     :param server: The server to which we connect.
     :param dev_chat: determines which chat we connect to.
     :param url: A url to completely replace the server/port behaviour
+    :param codec: JSON codec from flist.codec, defaults to the fastest installed backend.
+    :param reconnect: Reconnect when the connection drops, True or a flist.chat.reconnect.Backoff.
     :return deferred which fires with the chat instance once the connection has been established and introduction fired.
     """
     from flist.fchat import Connection
     from flist.chat.protocol import FChatProtocol
     from flist.chat.transport import DefaultFChatTransport
-    transport = DefaultFChatTransport(url)
+    transport = DefaultFChatTransport(url, codec=codec)
     protocol = FChatProtocol(transport)
-    chat = Connection(protocol, character).connect()
+    chat = Connection(protocol, character).connect(reconnect=reconnect)
     return chat
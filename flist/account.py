@@ -1,7 +1,8 @@
 import weakref
-import flist.api as api
 import logging
 
+from flist.tickets import TicketManager
+
 logger = logging.getLogger(__name__)
 
 
@@ -26,27 +27,39 @@ class Character:
 
 
 class Account:
-    def __init__(self, accountname, password):
+    """An f-list account.
+    :param tickets: flist.tickets.TicketStore shared with other processes, by default tickets are only
+        kept by this process. The ticket is refreshed ahead of its expiry once logged in.
+    """
+
+    def __init__(self, accountname, password, tickets=None):
         self.characters = {}
         self.account = accountname
         self.password = password
         self.bookmarks = []
         self.friends = []
-        self._ticket = []
+        self.tickets = TicketManager(accountname, password, tickets)
         self.character_names = []
         self.characters = weakref.WeakValueDictionary()
 
     async def login(self):
-        await self.refresh(self.password)
+        """Apply the account data of a valid ticket, only asking the API when there is none."""
+        self._apply(await self.tickets.get())
+        self.tickets.start()
         return self
 
     async def refresh(self, password):
-        data = await api.get_ticket(self.account, password)
-        if data.get('error'):
-            raise ConnectionRefusedError(data['error'])
+        """Fetch a new ticket, invalidating the current one."""
+        self.tickets.password = password
+        self._apply(await self.tickets.get(stale=self.tickets.ticket))
+
+    async def renew_ticket(self, refused):
+        """Replace a ticket refused by the server, unless another process already did."""
+        self._apply(await self.tickets.get(stale=refused))
+
+    def _apply(self, data):
         self.bookmarks = data['bookmarks']
         self.friends = data['friends']
-        self._ticket = data['ticket']
         self.character_names = data['characters']
 
     def get_character(self, charname):
@@ -61,7 +74,8 @@ class Account:
 
     @property
     def ticket(self):
-        return self._ticket
+        """The current ticket from memory, None once it has expired."""
+        return self.tickets.ticket
 
     def __str__(self):
         return self.account
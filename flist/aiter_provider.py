@@ -1,28 +1,129 @@
 import collections
 import asyncio
 
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+COALESCE = "coalesce"
+BLOCK = "block"
+
 
 class Provider:
-    def __init__(self, **kwargs):
-        self.buffer = collections.deque()
-        self._add_new_future()
+    """Async iterator fed through put_item.
+
+    :param maxsize: Maximum number of buffered items, None for unbounded.
+    :param overflow: What happens to put_item when the buffer is full;
+        DROP_OLDEST discards the oldest buffered item, DROP_NEWEST discards the new item,
+        COALESCE replaces the buffered item with the same key(item) and otherwise drops the oldest,
+        BLOCK returns a future from put_item which resolves once the item fits in the buffer. It does
+        not block without bound: at most maxsize items wait that way and further items are dropped,
+        returning None, and an item whose future is cancelled is dropped as well. The protocol holds
+        back the bulk of its inbound frames while such a future is pending, for at most the
+        hold_timeout of its InboundQueue, after which it cancels the future.
+    :param key: f(item) used by COALESCE.
 
-    def _add_new_future(self):
-        self.current_value = asyncio.Future()
-        self.buffer.append(self.current_value)
+    dropped, coalesced and blocked count the items affected by the overflow policy,
+    high_water is the largest buffer size seen.
+    """
+
+    def __init__(self, *, maxsize=None, overflow=DROP_OLDEST, key=None, **kwargs):
+        if overflow == COALESCE and key is None:
+            raise ValueError("The coalesce overflow policy requires a key function.")
+        self.buffer = collections.deque()
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.key = key
+        self.closed = False
+        self.dropped = 0
+        self.coalesced = 0
+        self.blocked = 0
+        self.high_water = 0
+        self._waiter = None
+        self._blocked = collections.deque()
 
     def __aiter__(self):
         return self
 
+    def __len__(self):
+        return len(self.buffer)
+
     async def __anext__(self):
-        return await self.buffer.popleft()
+        while not self.buffer:
+            if self.closed:
+                raise StopAsyncIteration
+            self._waiter = asyncio.get_event_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        item = self.buffer.popleft()
+        if self._blocked:
+            self._unblock()
+        return item
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _unblock(self):
+        while self._blocked and len(self.buffer) < self.maxsize:
+            future, item = self._blocked.popleft()
+            if future.cancelled():
+                self.dropped += 1
+            else:
+                self._append(item)
+                future.set_result(None)
+
+    def _prune(self):
+        while self._blocked and self._blocked[0][0].cancelled():
+            self._blocked.popleft()
+            self.dropped += 1
+
+    def _append(self, item):
+        self.buffer.append(item)
+        if len(self.buffer) > self.high_water:
+            self.high_water = len(self.buffer)
+        self._wake()
+
+    def _coalesce(self, item):
+        key = self.key(item)
+        for index, buffered in enumerate(self.buffer):
+            if self.key(buffered) == key:
+                self.buffer[index] = item
+                self.coalesced += 1
+                return True
+        return False
 
     def put_item(self, item):
-        self.current_value.set_result(item)
-        self._add_new_future()
+        if self.closed:
+            raise BrokenPipeError("The provider is closed.")
+        if self.maxsize is None or len(self.buffer) < self.maxsize and not self._blocked:
+            self._append(item)
+        elif self.overflow == DROP_NEWEST:
+            self.dropped += 1
+        elif self.overflow == BLOCK:
+            self._prune()
+            if len(self._blocked) >= self.maxsize:
+                self.dropped += 1
+                return None
+            self.blocked += 1
+            future = asyncio.get_event_loop().create_future()
+            self._blocked.append((future, item))
+            return future
+        elif self.overflow == COALESCE and self._coalesce(item):
+            pass
+        else:
+            self.buffer.popleft()
+            self.dropped += 1
+            self._append(item)
 
     def close(self):
-        self.current_value.set_exception(StopAsyncIteration)
+        self.closed = True
+        while self._blocked:
+            future, item = self._blocked.popleft()
+            if not future.cancelled():
+                self.buffer.append(item)
+                future.set_result(None)
+        self._wake()
 
 
 class CountProvider(Provider):
@@ -31,10 +132,11 @@ class CountProvider(Provider):
         self.count = count
 
     def put_item(self, item):
-        super().put_item(item)
+        result = super().put_item(item)
         self.count -= 1
         if self.count == 0:
             self.close()
+        return result
 
 
 class CloserProvider(Provider):
@@ -43,6 +145,8 @@ class CloserProvider(Provider):
         self._closer = closer
 
     def close(self):
+        if self.closed:
+            return
         super().close()
         self._closer(self)
 
@@ -1,40 +1,249 @@
+import asyncio
+import copy
+from collections import namedtuple
 from functools import wraps
 import aiohttp
 
+from flist.cache import TTLCache
+from flist.codec import default_codec
+
 import logging
 logger = logging.getLogger(__name__)
 
+# JSON codec used to decode API responses, replace with flist.codec.get_codec(name) to pick a backend.
+# Clients created without a codec of their own use it.
+codec = default_codec
+
+flist_ticket_url = "https://www.f-list.net/json/getApiTicket.php"
+flist_api_url = "https://www.f-list.net/json/api/{function}.php"
+
+
+class APICache(object):
+    """Response cache for the read-only API endpoints.
 
-async def get_ticket(account, password):
+    Responses are keyed on the endpoint, the account and the other arguments, the ticket is ignored.
+    Error responses are never cached. Every caller gets a copy, so changing a response leaves the cache alone.
+
+    :param ttls: dict of endpoint name to time to live in seconds, None caches for the lifetime of the process.
+        Endpoints missing from the dict are not cached.
+    :param maxsize: Maximum number of expiring responses kept.
+    """
+    default_ttls = {
+        'character_get': 600,
+        'character_info': 600,
+        'character_kinks': 600,
+        'character_images': 600,
+        'group_list': 3600,
+        'info_list': None,
+        'kink_list': None,
+    }
+    ignored_arguments = ('ticket',)
+
+    def __init__(self, ttls=None, maxsize=1024):
+        self.ttls = dict(self.default_ttls if ttls is None else ttls)
+        self.responses = TTLCache(maxsize=maxsize)
+
+    def _key(self, api_name, data):
+        return (api_name,) + tuple(sorted((k, v) for k, v in data.items() if k not in self.ignored_arguments))
+
+    @staticmethod
+    def _cacheable(response):
+        return not (isinstance(response, dict) and response.get('error'))
+
+    async def fetch(self, api_name, data, fetch):
+        if api_name not in self.ttls:
+            return await fetch()
+        response = await self.responses.get_or_fetch(self._key(api_name, data), fetch,
+                                                     ttl=self.ttls[api_name], cacheable=self._cacheable)
+        return copy.deepcopy(response)
+
+    def invalidate(self, api_name=None, **arguments):
+        """Drop cached responses.
+        Without arguments everything is dropped, with only api_name every response of that endpoint,
+        otherwise the single response for the endpoint called with the given arguments.
+        """
+        if api_name is None:
+            self.responses.clear()
+        elif arguments:
+            self.responses.invalidate(self._key(api_name, arguments))
+        else:
+            for key in self.responses.keys():
+                if key[0] == api_name:
+                    self.responses.invalidate(key)
+
+
+class APIClient(object):
+    """Owns a long lived aiohttp session shared by all API calls made through it.
+
+    The session belongs to the event loop it was created on, close() it while that loop still runs.
+    Used from another loop the client starts a new session; the old one is closed on its loop when that
+    loop runs in another thread, and otherwise left with a warning, as nothing can run on it anymore.
+
+    :param limit: Maximum number of simultaneous connections to the site.
+    :param keepalive_timeout: Seconds an idle connection is kept open for reuse.
+    :param timeout: Total timeout in seconds for a single request.
+    :param codec: JSON codec from flist.codec used to decode responses, defaults to the module codec.
+    :param cache: APICache for read-only endpoints, False disables caching.
+    """
+
+    def __init__(self, limit=8, keepalive_timeout=60, timeout=30, codec=None, cache=None):
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self._codec = codec
+        self.cache = APICache() if cache is None else cache
+        self._session = None
+        self._loop = None
+
+    @property
+    def codec(self):
+        return self._codec or codec
+
+    @property
+    def session(self):
+        loop = asyncio.get_event_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            self._discard()
+            connector = aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                json_serialize=self.codec.dumps,
+            )
+            self._loop = loop
+        return self._session
+
+    def _discard(self):
+        """Let go of a session left behind on another event loop."""
+        session, loop = self._session, self._loop
+        self._session = None
+        if session is None or session.closed:
+            return
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+        else:
+            logger.warning("The API session of a stopped event loop was not closed, "
+                           "call close() before the loop stops.")
+
+    async def post(self, url, data):
+        async with self.session.post(url, data=data) as response:
+            return await response.json(loads=self.codec.loads)
+
+    async def get_ticket(self, account, password):
+        data = {
+            'account': account,
+            'password': password,
+        }
+        logger.info("F-List API call: getApiTicket{arguments}".format(arguments={'account': account}))
+        return await self.post(flist_ticket_url, data)
+
+    async def call(self, api_name, data):
+        async def fetch():
+            logger.info("F-List API call: {method}{arguments}".format(method=api_name, arguments=data))
+            return await self.post(flist_api_url.format(function=api_name.replace('_', '-')), data)
+
+        if self.cache:
+            return await self.cache.fetch(api_name, data, fetch)
+        return await fetch()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+default_client = APIClient()
+
+
+async def close():
+    """Close the session of the default client, call it before the event loop stops."""
+    await default_client.close()
+
+
+async def get_ticket(account, password, *, client=None):
     """You'll receive a ticket and a ton of other things that you probably won't need unless you're
     making an f-chat client. Tickets are valid for 24 hours from issue, and invalidate all previous
     tickets for the account when issued."""
-    data = {
-        'account': account,
-        'password': password,
-    }
-    logger.info("F-List API call: getApiTicket{arguments}".format(arguments=data))
-    async with aiohttp.ClientSession() as session:
-        async with session.post("https://www.f-list.net/json/getApiTicket.php", data=data) as response:
-            return await response.json()
+    return await (client or default_client).get_ticket(account, password)
+
+
+def invalidate_cache(api_name=None, **arguments):
+    """Drop cached responses of the default client, see APICache.invalidate."""
+    if default_client.cache:
+        default_client.cache.invalidate(api_name, **arguments)
+
+
+BulkResult = namedtuple('BulkResult', ['name', 'result', 'error'])
+
+
+async def fetch_many(endpoint, names, *, concurrency=4, ordered=False, client=None, **arguments):
+    """Call an endpoint for many characters, yielding BulkResult(name, result, error) as they complete.
+    :param endpoint: One of the character endpoints of this module, such as character_info.
+    :param names: Iterable of character names.
+    :param concurrency: Maximum number of requests in flight.
+    :param ordered: Yield results in the order of names rather than as they complete.
+    :param arguments: Further endpoint arguments such as account and ticket.
+
+    A failing request does not stop the batch, its exception is found on the error field.
+    An exception raised by names ends the batch and is raised once the running requests have finished.
+    """
+    indexed_names = enumerate(names)
+    results = asyncio.Queue()
+    failures = []
+
+    async def worker():
+        try:
+            for index, name in indexed_names:
+                try:
+                    result = await endpoint(client=client, name=name, **arguments)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    item = BulkResult(name, None, e)
+                else:
+                    item = BulkResult(name, result, None)
+                results.put_nowait((index, item))
+        except Exception as e:  # Raised by names, failed requests are reported above.
+            failures.append(e)
+        finally:
+            results.put_nowait(None)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(max(1, concurrency))]
+    try:
+        running = len(workers)
+        held = {}
+        next_index = 0
+        while running:
+            entry = await results.get()
+            if entry is None:
+                running -= 1
+                continue
+            index, item = entry
+            if not ordered:
+                yield item
+                continue
+            held[index] = item
+            while next_index in held:
+                yield held.pop(next_index)
+                next_index += 1
+        if failures:
+            raise failures[0]
+    finally:
+        for w in workers:
+            w.cancel()
 
 
 # API definitions
 def flist_api_decorator(func):
-    api_variables = func.__code__.co_varnames
+    api_variables = func.__code__.co_varnames[:func.__code__.co_argcount]
     api_name = func.__name__
-    flist_api_url = "https://www.f-list.net/json/api/{function}.php"
 
     @wraps(func)
-    async def wrapper(**kwargs):
-        logger.info("F-List API call: {method}{arguments}".format(method=api_name, arguments=kwargs))
+    async def wrapper(*, client=None, **kwargs):
         data = {}
         for argument in api_variables:
             data[argument] = kwargs.get(argument)
-
-        async with aiohttp.ClientSession() as session:
-            async with session.post(flist_api_url.format(function=api_name.replace('_', '-')), data=data) as response:
-                return await response.json()
+        return await (client or default_client).call(api_name, data)
 
     return wrapper
 
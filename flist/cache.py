@@ -0,0 +1,101 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+_default = object()
+
+
+class TTLCache(object):
+    """Size bounded LRU mapping whose entries expire after a time to live.
+
+    Entries stored with ttl=None never expire and are not subject to LRU eviction.
+    Concurrent get_or_fetch calls for the same key share a single fetch.
+
+    :param maxsize: Maximum number of expiring entries kept.
+    :param ttl: Default time to live in seconds.
+    :param clock: Monotonic time source.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._permanent = {}
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries) + len(self._permanent)
+
+    def __contains__(self, key):
+        return self.get(key, _default) is not _default
+
+    def keys(self):
+        return list(self._permanent) + list(self._entries)
+
+    def get(self, key, default=None):
+        try:
+            return self._permanent[key]
+        except KeyError:
+            pass
+        try:
+            expires, value = self._entries[key]
+        except KeyError:
+            return default
+        if expires <= self.clock():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=_default):
+        if ttl is _default:
+            ttl = self.ttl
+        self.invalidate(key)
+        if ttl is None:
+            self._permanent[key] = value
+            return
+        self._entries[key] = (self.clock() + ttl, value)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._pending.pop(key, None)
+        self._permanent.pop(key, None)
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._pending.clear()
+        self._permanent.clear()
+        self._entries.clear()
+
+    async def get_or_fetch(self, key, fetch, ttl=_default, cacheable=None):
+        """Return the cached value for key, or await fetch() once for all concurrent callers.
+        :param fetch: Callable returning an awaitable of the value.
+        :param cacheable: Optional predicate; values failing it are returned but not stored.
+        """
+        value = self.get(key, _default)
+        if value is not _default:
+            self.hits += 1
+            return value
+
+        task = self._pending.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(fetch())
+            self._pending[key] = task
+
+            def done(t):
+                if self._pending.get(key) is not t:
+                    return  # Invalidated while the fetch was in flight.
+                del self._pending[key]
+                if not t.cancelled() and t.exception() is None:
+                    if cacheable is None or cacheable(t.result()):
+                        self.set(key, t.result(), ttl)
+
+            task.add_done_callback(done)
+        else:
+            self.hits += 1
+        return await asyncio.shield(task)
@@ -0,0 +1,100 @@
+class CallbackHandle(object):
+    """Registration of a callback, remove() unsubscribes it in O(1), also while it is being dispatched."""
+    __slots__ = ('callbacks', 'callback', 'index', 'active')
+
+    def __init__(self, callbacks, callback, index):
+        self.callbacks = callbacks
+        self.callback = callback
+        self.index = index
+        self.active = True
+
+    def remove(self):
+        self.callbacks.discard(self)
+
+
+class CallbackList(object):
+    """The callbacks of one opcode, in registration order.
+
+    slots holds the callbacks for dispatch, removal replaces a callback with None; the list is compacted
+    once enough empty slots have accumulated and no dispatch is iterating it, so dispatch never copies it.
+    Callbacks added during a dispatch are first called for the next frame.
+    """
+    __slots__ = ('slots', 'handles', 'by_callback', 'active', 'dispatching')
+
+    def __init__(self):
+        self.slots = []
+        self.handles = []
+        self.by_callback = {}
+        self.active = 0
+        self.dispatching = 0
+
+    def __len__(self):
+        return self.active
+
+    def __iter__(self):
+        return (f for f in self.slots if f is not None)
+
+    def add(self, callback):
+        handle = CallbackHandle(self, callback, len(self.slots))
+        self.slots.append(callback)
+        self.handles.append(handle)
+        self.by_callback.setdefault(callback, []).append(handle)
+        self.active += 1
+        return handle
+
+    def remove(self, callback):
+        """Remove the earliest registration of callback, raises ValueError when it is not registered."""
+        try:
+            handle = self.by_callback[callback][0]
+        except KeyError:
+            raise ValueError("Callback is not registered: %r" % (callback,))
+        self.discard(handle)
+
+    def discard_at(self, index):
+        """Remove the registration in slot index, as seen by the dispatch in progress."""
+        self.discard(self.handles[index])
+
+    def discard(self, handle):
+        if not handle.active:
+            return
+        handle.active = False
+        self.slots[handle.index] = None
+        self.active -= 1
+        registered = self.by_callback[handle.callback]
+        if len(registered) == 1:
+            del self.by_callback[handle.callback]
+        else:
+            registered.remove(handle)
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        if not self.dispatching and len(self.slots) > 2 * self.active + 8:
+            self.handles = [h for h in self.handles if h.active]
+            for index, handle in enumerate(self.handles):
+                handle.index = index
+            self.slots = [h.callback for h in self.handles]
+
+    def begin(self):
+        """Start a dispatch, returns the number of slots to visit."""
+        self.dispatching += 1
+        return len(self.slots)
+
+    def end(self):
+        self.dispatching -= 1
+        self._maybe_compact()
+
+
+class CallbackRegistry(dict):
+    """Mapping of opcode to CallbackList."""
+
+    def add(self, op, callback):
+        callbacks = self.get(op)
+        if callbacks is None:
+            callbacks = self[op] = CallbackList()
+        return callbacks.add(callback)
+
+    def remove(self, op, callback):
+        callbacks = self.get(op)
+        if callbacks is None:
+            raise ValueError("No callbacks registered for %s" % op)
+        callbacks.remove(callback)
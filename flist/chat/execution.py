@@ -0,0 +1,187 @@
+import asyncio
+import collections
+import logging
+from inspect import isawaitable
+
+from flist.chat import opcode as opcode
+
+logger = logging.getLogger(__name__)
+
+# Awaitables from these opcodes run one at a time per key, in arrival order.
+default_lane_keys = {
+    opcode.CHANNEL_MESSAGE: lambda message: message.get('channel'),
+    opcode.PRIVATE_MESSAGE: lambda message: message.get('character'),
+}
+
+
+async def chain(awaitables):
+    """Await several awaitables one after the other."""
+    for awaitable in awaitables:
+        await awaitable
+
+
+def collect(results):
+    """Combine callback results into a single awaitable, or None when none of them is awaitable."""
+    awaitables = [r for r in results if isawaitable(r)]
+    if not awaitables:
+        return None
+    if len(awaitables) == 1:
+        return awaitables[0]
+    return chain(awaitables)
+
+
+class Unordered(object):
+    """Awaitable the ExecutionPolicy runs outside the lanes, for callbacks which bound and queue their own work."""
+    __slots__ = ('awaitable',)
+
+    def __init__(self, awaitable):
+        self.awaitable = awaitable
+
+    def __await__(self):
+        return self.awaitable.__await__()
+
+
+class ExecutionPolicy(object):
+    """Runs the awaitables returned by callbacks with bounded concurrency.
+
+    At most limit awaitables run at once, and at most op_limits[op] for an opcode. Awaitables whose
+    opcode has a lane key function run one at a time per key in arrival order, such as one lane per
+    channel for MSG. Running tasks are tracked, their exceptions are logged, and drain() or cancel()
+    finish them on shutdown.
+
+    Plain futures, such as those of a watch() provider waiting for room in its buffer, are not work of
+    their own; they are held outside the limits and lanes, so a stalled consumer does not take the
+    slots of other callbacks, and are handed to on_hold which can apply backpressure.
+
+    :param limit: Maximum number of awaitables running at once.
+    :param op_limits: dict of opcode to the maximum running at once for that opcode.
+    :param lane_keys: dict of opcode to f(message) giving the ordering key, None to run unordered.
+        Awaitables wrapped in Unordered skip the lanes.
+    :param on_hold: f(future) called for every held future.
+    """
+
+    def __init__(self, loop, limit=100, op_limits=None, lane_keys=None, on_hold=None):
+        self.loop = loop
+        self.limit = limit
+        self.op_limits = dict(op_limits or {})
+        self.lane_keys = dict(default_lane_keys if lane_keys is None else lane_keys)
+        self.running = 0
+        self.running_by_op = collections.Counter()
+        self.waiting = collections.deque()
+        self.lanes = {}
+        self.tasks = set()
+        self.held = set()
+        self.on_hold = on_hold
+        self.completed = 0
+        self.failed = 0
+        self._idle = None
+
+    @property
+    def queued(self):
+        return len(self.waiting) + sum(len(lane) for lane in self.lanes.values())
+
+    def submit(self, op, message, awaitable):
+        if asyncio.isfuture(awaitable):
+            self._hold(op, awaitable)
+            return
+        key = None
+        if type(awaitable) is Unordered:
+            self._start_or_wait(op, key, awaitable.awaitable)
+            return
+        key_function = self.lane_keys.get(op)
+        if key_function is not None and isinstance(message, dict):
+            key = (op, key_function(message))
+            lane = self.lanes.get(key)
+            if lane is not None:
+                lane.append(awaitable)
+                return
+            self.lanes[key] = collections.deque()
+        self._start_or_wait(op, key, awaitable)
+
+    def _hold(self, op, future):
+        self.held.add(future)
+
+        def done(f):
+            self.held.discard(f)
+            # A gather over cancelled futures ends with a CancelledError instead of being cancelled itself.
+            if not f.cancelled() and not isinstance(f.exception(), (type(None), asyncio.CancelledError)):
+                self.failed += 1
+                logger.error("Callback for %s failed.", op, exc_info=f.exception())
+
+        future.add_done_callback(done)
+        if self.on_hold is not None:
+            self.on_hold(future)
+
+    def _has_room(self, op):
+        if self.running >= self.limit:
+            return False
+        op_limit = self.op_limits.get(op)
+        return op_limit is None or self.running_by_op[op] < op_limit
+
+    def _start_or_wait(self, op, key, awaitable):
+        if self._has_room(op):
+            self._start(op, key, awaitable)
+        else:
+            self.waiting.append((op, key, awaitable))
+
+    def _start(self, op, key, awaitable):
+        self.running += 1
+        self.running_by_op[op] += 1
+        task = asyncio.ensure_future(awaitable, loop=self.loop)
+        self.tasks.add(task)
+        task.add_done_callback(lambda t: self._done(op, key, t))
+
+    def _done(self, op, key, task):
+        self.tasks.discard(task)
+        self.running -= 1
+        self.running_by_op[op] -= 1
+        if task.cancelled():
+            pass
+        elif task.exception() is not None:
+            self.failed += 1
+            logger.error("Callback for %s failed.", op, exc_info=task.exception())
+        else:
+            self.completed += 1
+
+        if key is not None:
+            lane = self.lanes.get(key)
+            if lane:
+                self._start_or_wait(op, key, lane.popleft())
+            elif lane is not None:
+                del self.lanes[key]
+
+        for _ in range(len(self.waiting)):
+            if self.running >= self.limit:
+                break
+            entry = self.waiting.popleft()
+            if self._has_room(entry[0]):
+                self._start(*entry)
+            else:
+                self.waiting.append(entry)
+
+        if not self.tasks and self._idle is not None and not self._idle.done():
+            self._idle.set_result(None)
+
+    async def drain(self):
+        """Wait until everything submitted so far has finished."""
+        while self.tasks:
+            if self._idle is None or self._idle.done():
+                self._idle = self.loop.create_future()
+            await asyncio.shield(self._idle)
+
+    def cancel(self):
+        """Cancel running tasks and discard everything queued."""
+        pending = [entry[2] for entry in self.waiting]
+        for lane in self.lanes.values():
+            pending.extend(lane)
+        self.waiting.clear()
+        self.lanes.clear()
+        for awaitable in pending:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            elif asyncio.isfuture(awaitable):
+                awaitable.cancel()
+        for task in list(self.tasks):
+            task.cancel()
+        for future in list(self.held):
+            future.cancel()
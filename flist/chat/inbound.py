@@ -0,0 +1,164 @@
+import collections
+import logging
+
+from flist.chat import opcode as opcode
+
+logger = logging.getLogger(__name__)
+
+PRIORITY = 0
+BULK = 1
+
+# Frames which are dispatched ahead of anything waiting in the bulk lane.
+priority_opcodes = frozenset([
+    opcode.PING,
+    opcode.ERROR,
+    opcode.IDENTIFY,
+    opcode.SYSTEM_MESSAGE,
+    opcode.BROADCAST,
+    opcode.SERVER_KICK,
+    opcode.TIMEOUT,
+    opcode.KICK,
+    opcode.BAN,
+])
+
+# Frames which are dropped rather than queued once the bulk lane is backed up.
+# A shed STA leaves a roster with a stale status, so Connection stops shedding STA for the queue it reads.
+shed_opcodes = frozenset([
+    opcode.TYPING,
+    opcode.STATUS,
+])
+
+
+class InboundQueue(object):
+    """Separates reading frames off the websocket from dispatching them.
+
+    The reader puts every frame in a lane and returns at once; dispatch runs in batches scheduled with
+    call_soon and always empties the priority lane first, so a PIN is answered even while thousands of
+    MSG frames are waiting on slow handlers. Once shed_depth frames are waiting in the bulk lane new
+    frames of the shed opcodes are dropped, and once maxsize are waiting the reader should wait_for_space.
+    Shedding trades completeness for latency: state kept from shed opcodes goes stale without notice,
+    so STA is only shed while nothing, such as a Connection roster, tracks statuses.
+    While a future passed to hold() is pending only the priority lane is dispatched, so a consumer which
+    cannot keep up fills the bulk lane and holds back the reader instead of buffering without bound.
+    The whole bulk lane waits for it, and a reader held back leaves PIN unread in the socket, so a hold
+    is bounded: after hold_timeout seconds its future is cancelled, which drops the item it stood for,
+    and further holds are ignored until the bulk lane has emptied, so the consumer's overflow policy
+    drops what it cannot take meanwhile. Keep hold_timeout well below the server's ping interval.
+
+    :param dispatch: f(frame) which decodes and delivers a frame.
+    :param maxsize: Number of frames in the bulk lane after which the reader is held back.
+    :param shed_depth: Number of frames in the bulk lane after which shed_opcodes are dropped.
+    :param batch: Maximum number of frames dispatched before the loop gets to run other work.
+    :param shed: Opcodes which are shed, shed_opcodes by default.
+    :param hold_timeout: Seconds a future passed to hold() may pause the bulk lane.
+    """
+
+    def __init__(self, dispatch, loop, maxsize=4096, shed_depth=1024, batch=100, shed=shed_opcodes,
+                 hold_timeout=10):
+        self.dispatch = dispatch
+        self.loop = loop
+        self.maxsize = maxsize
+        self.shed_depth = shed_depth
+        self.batch = batch
+        self.shed_opcodes = set(shed)
+        self.hold_timeout = hold_timeout
+        self.lanes = (collections.deque(), collections.deque())
+        self.received = 0
+        self.dispatched = 0
+        self.shed = 0
+        self.high_water = 0
+        self.expired = 0
+        self.holds = {}
+        self._holds_expired = False
+        self._handle = None
+        self._space_waiters = collections.deque()
+
+    def depth(self, lane=BULK):
+        return len(self.lanes[lane])
+
+    @property
+    def full(self):
+        return len(self.lanes[BULK]) >= self.maxsize
+
+    def put(self, frame):
+        op = frame[:3]
+        self.received += 1
+        if op in priority_opcodes:
+            self.lanes[PRIORITY].append(frame)
+        else:
+            bulk = self.lanes[BULK]
+            if op in self.shed_opcodes and len(bulk) >= self.shed_depth:
+                self.shed += 1
+                return
+            bulk.append(frame)
+            if len(bulk) > self.high_water:
+                self.high_water = len(bulk)
+        if self._handle is None:
+            self._handle = self.loop.call_soon(self._dispatch)
+
+    def hold(self, future):
+        """Pause the bulk lane until future is done, cancelling it after hold_timeout seconds."""
+        if future.done() or self._holds_expired:
+            return
+        self.holds[future] = self.loop.call_later(self.hold_timeout, self._expire, future)
+        future.add_done_callback(self._release)
+
+    def _expire(self, future):
+        if future in self.holds:
+            self.expired += 1
+            self._holds_expired = True
+            logger.warning("A consumer held the inbound frames for %s seconds, dropping its item.", self.hold_timeout)
+            future.cancel()
+
+    def _release(self, future):
+        timer = self.holds.pop(future, None)
+        if timer is not None:
+            timer.cancel()
+        if not self.holds and self.lanes[BULK] and self._handle is None:
+            self._handle = self.loop.call_soon(self._dispatch)
+
+    async def wait_for_space(self):
+        while self.full:
+            waiter = self.loop.create_future()
+            self._space_waiters.append(waiter)
+            await waiter
+
+    def _dispatch(self):
+        self._handle = None
+        priority, bulk = self.lanes
+        for _ in range(self.batch):
+            if priority:
+                frame = priority.popleft()
+            elif bulk and not self.holds:
+                frame = bulk.popleft()
+            else:
+                break
+            self.dispatched += 1
+            # noinspection PyBroadException
+            try:
+                self.dispatch(frame)
+            except Exception:
+                logger.exception("Dispatching frame %.40r failed.", frame)
+
+        while self._space_waiters and not self.full:
+            waiter = self._space_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+        if not bulk:
+            self._holds_expired = False
+        if priority or bulk and not self.holds:
+            self._handle = self.loop.call_soon(self._dispatch)
+
+    def clear(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        for lane in self.lanes:
+            lane.clear()
+        for timer in self.holds.values():
+            timer.cancel()
+        self.holds.clear()
+        self._holds_expired = False
+        while self._space_waiters:
+            self._space_waiters.popleft().cancel()
@@ -0,0 +1,107 @@
+import asyncio
+import collections
+import logging
+from inspect import isawaitable
+
+from flist.chat.execution import Unordered
+
+logger = logging.getLogger(__name__)
+
+
+class OffloadedCallback(object):
+    """Callback which runs a CPU heavy function in an executor, so it does not stall the event loop.
+
+    Calling it takes a slot and returns an awaitable, which has to be awaited to give the slot back; when
+    registered as protocol callback the ExecutionPolicy of the protocol runs it outside its per channel
+    lanes, so the backlog is bounded and counted here. At most limit calls run in the executor at once,
+    further calls wait in order and once maxsize calls are waiting new ones are dropped: the call returns
+    None and no task is created for it. The result is delivered back on the loop; with a limit above one
+    the results of a channel may arrive out of order.
+
+    For a ProcessPoolExecutor the function and its payload are pickled; the function must be defined at
+    module level, and a payload function trimming the message to the fields it needs keeps that cheap.
+
+    :param function: f(payload) run in the executor.
+    :param executor: concurrent.futures executor, None for the default thread pool of the loop.
+    :param limit: Maximum number of calls running in the executor at once.
+    :param maxsize: Maximum number of calls waiting for the executor, None for unbounded.
+    :param payload: f(message) giving what is shipped to the executor, the message itself by default.
+    :param deliver: f(message, result) called on the loop with the result, may return an awaitable.
+
+    running, queued, high_water, completed, failed and dropped are kept as metrics.
+    """
+
+    def __init__(self, function, executor=None, *, limit=1, maxsize=None, payload=None, deliver=None):
+        self.function = function
+        self.executor = executor
+        self.limit = limit
+        self.maxsize = maxsize
+        self.payload = payload
+        self.deliver = deliver
+        self.running = 0
+        self.queued = 0
+        self.waiting = collections.deque()
+        self.high_water = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def __call__(self, message):
+        if self.running < self.limit:
+            self.running += 1
+            return Unordered(self._run(message))
+        if self.maxsize is not None and self.queued >= self.maxsize:
+            self.dropped += 1
+            return None
+        self.queued += 1
+        self.high_water = max(self.high_water, self.queued)
+        return Unordered(self._run(message, queued=True))
+
+    async def _run(self, message, queued=False):
+        loop = asyncio.get_event_loop()
+        if queued and self.running < self.limit and not self.waiting:
+            # A slot was freed before this call started.
+            self.queued -= 1
+            self.running += 1
+        elif queued:
+            waiter = loop.create_future()
+            self.waiting.append(waiter)
+            try:
+                await waiter  # The finishing call hands over its slot.
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release()
+                else:
+                    self.queued -= 1
+                raise
+        try:
+            payload = message if self.payload is None else self.payload(message)
+            result = await loop.run_in_executor(self.executor, self.function, payload)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self._release()
+        self.completed += 1
+        if self.deliver is None:
+            return result
+        delivered = self.deliver(message, result)
+        if isawaitable(delivered):
+            return await delivered
+        return delivered
+
+    def _release(self):
+        while self.waiting:
+            waiter = self.waiting.popleft()
+            if not waiter.done():
+                self.queued -= 1
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+
+def offload(function=None, executor=None, **options):
+    """Wrap function in an OffloadedCallback, usable as decorator with or without options."""
+    if function is None:
+        return lambda f: OffloadedCallback(f, executor, **options)
+    return OffloadedCallback(function, executor, **options)
@@ -3,6 +3,7 @@ ACCOUNT_BAN = "ACB"
 ACCOUNT_UNBAN = "UBN"
 ACCOUNT_TIMEOUT = "TMO"
 SERVER_KICK = "KIK"
+IP_BAN = "IPB"
 PROMOTE_GLOBAL_OP = "AOP"
 DEMOTE_GLOBAL_OP = "DOP"
 LIST_ALTS = "AWC"
@@ -29,6 +30,7 @@ INVITE = "CIU"
 LIST_OPS = "COL"
 SET_CHANNEL_MODE = "RMO"
 SET_PRIVATE_CHANNEL_STATE = "RST"
+ADVERTISE_CHANNEL = "RAN"
 ROLEPLAY_AD = "LRP"
 CHANNEL_MESSAGE = "MSG"
 
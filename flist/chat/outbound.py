@@ -0,0 +1,203 @@
+import asyncio
+import collections
+import logging
+from functools import partial
+
+from flist.chat import opcode as opcode
+
+logger = logging.getLogger(__name__)
+
+PRIORITY = 0
+DEFAULT = 1
+
+# Commands which are sent ahead of anything waiting in the default lane.
+priority_opcodes = frozenset([
+    opcode.PING,
+    opcode.IDENTIFY,
+    opcode.ACCOUNT_BAN,
+    opcode.ACCOUNT_UNBAN,
+    opcode.ACCOUNT_TIMEOUT,
+    opcode.SERVER_KICK,
+    opcode.TIMEOUT,
+    opcode.KICK,
+    opcode.BAN,
+    opcode.UNBAN,
+])
+
+# Server variables (VAR) giving the minimum seconds between commands of these opcodes.
+flood_variables = {
+    'msg_flood': (opcode.CHANNEL_MESSAGE, opcode.PRIVATE_MESSAGE, opcode.ROLL),
+    'lfrp_flood': (opcode.ROLEPLAY_AD,),
+}
+
+
+class OutboundQueue(object):
+    """Orders outgoing frames and holds back commands that would trip the server flood limits.
+
+    Frames are written immediately when nothing is queued ahead of them and their flood limit allows it,
+    otherwise they wait in their lane and a single timer drains the lanes in order, priority lane first.
+    Each queued frame has a future which resolves once the frame has been written, or fails with the
+    write error; most senders never await it, so failures are not reported as unretrieved. While paused,
+    such as while the connection is down, frames are held in their lanes, and once fail() was called
+    they and every later frame fail instead.
+
+    :param write: f(op, frame) which puts the frame on the wire, may return a future of the write.
+    :param maxsize: Maximum number of frames waiting in the default lane.
+    :param margin: Seconds added to every flood interval to absorb clock differences.
+    :param paused: Start paused, until resume().
+    """
+
+    def __init__(self, write, loop, maxsize=512, margin=0.05, paused=False):
+        self.write = write
+        self.loop = loop
+        self.maxsize = maxsize
+        self.margin = margin
+        self.lanes = (collections.deque(), collections.deque())
+        self.intervals = {}
+        self.last_sent = {}
+        self.sent = 0
+        self.paused = paused
+        self.error = None
+        self._timer = None
+        self._space_waiters = collections.deque()
+
+    def set_variable(self, name, value):
+        """Apply a server variable, ignoring those which are not flood limits."""
+        for op in flood_variables.get(name, ()):
+            self.intervals[op] = (name, float(value) + self.margin)
+
+    def depth(self, lane=DEFAULT):
+        return len(self.lanes[lane])
+
+    def lane_for(self, op):
+        return PRIORITY if op in priority_opcodes else DEFAULT
+
+    def _delay(self, op, now):
+        limit = self.intervals.get(op)
+        if limit is None:
+            return 0
+        group, interval = limit
+        last = self.last_sent.get(group)
+        if last is None:
+            return 0
+        return last + interval - now
+
+    def _send(self, op, frame, future):
+        try:
+            written = self.write(op, frame)
+        except Exception as e:
+            self._fail(future, e)
+            return
+        limit = self.intervals.get(op)
+        if limit is not None:
+            self.last_sent[limit[0]] = self.loop.time()
+        self.sent += 1
+        if asyncio.isfuture(written):
+            written.add_done_callback(partial(self._written, future))
+        else:
+            future.set_result(None)
+
+    @classmethod
+    def _written(cls, future, written):
+        if future.done():
+            return
+        if written.cancelled():
+            future.cancel()
+        elif written.exception() is not None:
+            cls._fail(future, written.exception())
+        else:
+            future.set_result(None)
+
+    @staticmethod
+    def _fail(future, error):
+        if future.done():
+            return
+        future.set_exception(error)
+        future.exception()  # Marks it retrieved, the sender may not await it.
+
+    def pause(self):
+        """Hold every frame until resume(), such as while the connection is down."""
+        self.paused = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def resume(self):
+        self.paused = False
+        self.error = None
+        if self._timer is None and any(self.lanes):
+            self._drain()
+
+    def put(self, op, frame, lane=None):
+        """Queue a frame, returning a future which resolves once it is sent.
+        Raises asyncio.QueueFull when the default lane is full, see wait_for_space.
+        """
+        if lane is None:
+            lane = self.lane_for(op)
+        future = self.loop.create_future()
+        if self.error is not None:
+            self._fail(future, self.error)
+            return future
+        if not self.paused and not any(self.lanes[:lane + 1]) and self._delay(op, self.loop.time()) <= 0:
+            self._send(op, frame, future)
+            return future
+
+        if lane == DEFAULT and len(self.lanes[DEFAULT]) >= self.maxsize:
+            raise asyncio.QueueFull()
+        self.lanes[lane].append((op, frame, future))
+        if self._timer is None and not self.paused:
+            self._drain()
+        return future
+
+    async def wait_for_space(self):
+        while len(self.lanes[DEFAULT]) >= self.maxsize:
+            waiter = self.loop.create_future()
+            self._space_waiters.append(waiter)
+            await waiter
+
+    def _drain(self):
+        self._timer = None
+        if self.paused:
+            return
+        wait = None
+        for lane in self.lanes:
+            while lane:
+                op, frame, future = lane[0]
+                if future.cancelled():
+                    lane.popleft()
+                    continue
+                delay = self._delay(op, self.loop.time())
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                    break
+                lane.popleft()
+                self._send(op, frame, future)
+
+        while self._space_waiters and len(self.lanes[DEFAULT]) < self.maxsize:
+            waiter = self._space_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+        if wait is not None:
+            self._timer = self.loop.call_later(wait, self._drain)
+
+    def fail(self, error):
+        """Fail every held frame and every frame put from now on with error, until resume().
+        For a connection which is closed for good."""
+        self.pause()
+        self.error = error
+        for lane in self.lanes:
+            while lane:
+                self._fail(lane.popleft()[2], error)
+        while self._space_waiters:
+            self._fail(self._space_waiters.popleft(), error)
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for lane in self.lanes:
+            while lane:
+                lane.popleft()[2].cancel()
+        while self._space_waiters:
+            self._space_waiters.popleft().cancel()
@@ -1,9 +1,14 @@
 import asyncio
-import json
 import logging
 from inspect import isawaitable
+from itertools import islice
 
 from flist.chat import opcode as opcode
+from flist.chat.callbacks import CallbackRegistry
+from flist.chat.execution import ExecutionPolicy
+from flist.chat.outbound import OutboundQueue
+from flist.chat.trace import WireTrace
+from flist.codec import default_codec
 
 logger = logging.getLogger(__name__)
 
@@ -12,94 +17,154 @@ class FChatProtocol(object):
     """Websocket protocol with included ping handler
     connect method: return deferred when the protocol is established.
 
-    add_op_callback: accepts a method which receives a dict object corresponding to the decoded JSON data.
+    add_op_callback: accepts a method which receives a dict object corresponding to the decoded JSON data,
+        returns a handle whose remove() unsubscribes it.
     remove_op_callback
 
     add_message_handler: accepts a method which receives the opcode and dict of the decoded JSON data.
     remove_message_handler
+
+    Raw frames are traced through a WireTrace on the flist.chat.protocol.<opcode> loggers.
+    The JSON codec defaults to the one used by the transport, or the fastest installed backend.
+    Frames are only decoded when a callback or handler is interested in the opcode,
+    and at most once per frame.
+
+    message: queues a command through the OutboundQueue, returns a future which resolves once it is written.
+        Commands are held while the connection is down and written once it is open again.
+    send: coroutine which waits for room in the queue and until the command is sent.
+
+    Awaitables returned by callbacks are run through an ExecutionPolicy, which bounds their concurrency
+    and keeps the awaitables of one channel or private conversation in arrival order.
+    close() cancels the ones still running, await execution.drain() first to let them finish.
+    CPU heavy callbacks can be wrapped with flist.chat.offload.offload to run in a thread or process pool.
     """
 
-    def __init__(self, transport, loop=None):
+    def __init__(self, transport, loop=None, codec=None, trace=None, execution=None):
         self.on_close = lambda *args: None
         self.on_open = lambda *args: None
 
-        self.callbacks = {}
-        self.handlers = []
+        self.callbacks = CallbackRegistry()
+        self.handlers = []  # (handler, opcodes) pairs, opcodes None for every opcode.
         self.transport = transport
+        self.codec = codec or getattr(transport, 'codec', None) or default_codec
+        self.trace = trace or WireTrace(logger)
 
         self.pinger = None
         self.loop = loop or asyncio.get_event_loop()
+        self.outbound = OutboundQueue(self._write_frame, self.loop, paused=True)
+        self.execution = execution or ExecutionPolicy(self.loop)
+        inbound = getattr(transport, 'inbound', None)
+        if inbound is not None and self.execution.on_hold is None:
+            self.execution.on_hold = inbound.hold
 
         self.add_op_callback(opcode.PING, self._ping_handler)
 
     def connect(self):
         self.transport.fchat_on_message = lambda *args: self.on_message(*args)
-        self.transport.fchat_on_close = lambda *args: self.on_close(*args)
-        self.transport.fchat_on_open = lambda *args: self.on_open(*args)
+        self.transport.fchat_on_close = lambda *args: self._closed(*args)
+        self.transport.fchat_on_open = lambda *args: self._opened(*args)
         self.transport.connect()
 
+    def _opened(self):
+        self.on_open()
+        self.outbound.resume()  # After on_open, so that an identification is queued ahead of held frames.
+
+    def _closed(self, code, reason):
+        self.outbound.pause()
+        self.on_close(code, reason)
+
     def close(self):
+        self.execution.cancel()
+        self.outbound.close()
         self.transport.close()
 
     def _ping_handler(self, message):
         self.message(opcode.PING)
 
-    @staticmethod
-    def _load_json(message):
+    def _load_json(self, message):
         try:
-            j = json.loads(message)
+            j = self.codec.loads(message)
         except ValueError:
             j = None
         return j
 
+    def _handlers_for(self, op):
+        return [h for h, opcodes in self.handlers if opcodes is None or op in opcodes]
+
     def on_message(self, message):
         op = message[:3]
-        callbacks = self.callbacks.get(op, [])
+        callbacks = self.callbacks.get(op)
+        handlers = self._handlers_for(op) if self.handlers else None
+        self.trace("<--", op, message)
+        if not callbacks and not handlers:
+            return
+
         json = self._load_json(message[4:])
 
-        for f in callbacks.copy():
-            # noinspection PyBroadException
+        if callbacks:
             try:
-                r = f(json)
-                if isawaitable(r):
-                    asyncio.ensure_future(r, loop=self.loop)
-            except BrokenPipeError:
-                callbacks.remove(f)  # Caused by a closed provider.
-            except Exception:
-                callbacks.remove(f)
-                logger.exception("While processing callbacks another exception"
-                                 f" occurred, callback function has been removed {f}")
-
-        for h in self.handlers:
-            h(op, json)
-        logger.getChild(op).info("<-- %s", message)
-
-    def _write(self, message):
+                for index, f in enumerate(islice(callbacks.slots, callbacks.begin())):
+                    if f is None:
+                        continue  # Removed since the dispatch started.
+                    # noinspection PyBroadException
+                    try:
+                        r = f(json)
+                        if isawaitable(r):
+                            self.execution.submit(op, json, r)
+                    except BrokenPipeError:
+                        callbacks.discard_at(index)  # Caused by a closed provider.
+                    except Exception:
+                        callbacks.discard_at(index)
+                        logger.exception("While processing callbacks another exception"
+                                         f" occurred, callback function has been removed {f}")
+            finally:
+                callbacks.end()
+
+        if handlers:
+            for h in handlers:
+                h(op, json)
+
+    def _write_frame(self, op, message):
         if self.transport:
-            logger.getChild(message[:3]).info("--> %s", message)
-            self.transport.send_message(message)
+            self.trace("-->", op, message)
+            return self.transport.send_message(message)
         else:
             logger.error("Attempt to write message to Missing client.")
 
-    def message(self, op, di=None):
+    def _write(self, message):
+        self._write_frame(message[:3], message)
+
+    def message(self, op, di=None, lane=None):
         if di:
-            self._write("%s %s" % (op, json.dumps(di)))
+            frame = "%s %s" % (op, self.codec.dumps(di))
         else:
-            self._write(op)
+            frame = op
+        return self.outbound.put(op, frame, lane)
+
+    async def send(self, op, di=None, lane=None):
+        await self.outbound.wait_for_space()
+        await self.message(op, di, lane)
 
     def add_op_callback(self, op, callback):
         """Callbacks take the form of f(message)"""
-        self.callbacks.setdefault(op, []).append(callback)
+        return self.callbacks.add(op, callback)
 
     def remove_op_callback(self, op, callback):
-        self.callbacks.setdefault(op, []).remove(callback)
+        self.callbacks.remove(op, callback)
 
-    def add_message_handler(self, handler):
-        """A message handler takes the form of f(opcode, message)"""
-        self.handlers.append(handler)
+    def add_message_handler(self, handler, opcodes=None):
+        """A message handler takes the form of f(opcode, message)
+        :param opcodes: Optional collection of opcodes the handler is interested in,
+            frames with other opcodes are not decoded on behalf of this handler.
+        """
+        self.handlers.append((handler, frozenset(opcodes) if opcodes is not None else None))
 
     def remove_message_handler(self, handler):
-        self.handlers.remove(handler)
+        for index, (h, opcodes) in enumerate(self.handlers):
+            if h == handler:
+                del self.handlers[index]
+                return
+        raise ValueError("%r is not a message handler." % (handler,))
 
     def callback(self, status):
         def deco(func):
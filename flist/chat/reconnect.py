@@ -0,0 +1,20 @@
+import random
+
+
+class Backoff(object):
+    """Delays between reconnect attempts, growing exponentially with random jitter.
+
+    The delay of an attempt is min(maximum, initial * factor ** attempt), reduced by up to jitter
+    of itself at random so that many clients dropped at once do not reconnect in lockstep.
+    """
+
+    def __init__(self, initial=1.0, maximum=60.0, factor=2.0, jitter=0.5, random=random.random):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.random = random
+
+    def delay(self, attempt):
+        base = min(self.maximum, self.initial * self.factor ** attempt)
+        return base * (1 - self.jitter * self.random())
@@ -0,0 +1,259 @@
+import asyncio
+import collections
+import logging
+from functools import partial
+
+from flist.cache import TTLCache
+from flist.chat import opcode as opcode
+
+logger = logging.getLogger(__name__)
+
+# ERR numbers the server answers requests with.
+CHARACTER_NOT_FOUND = 6
+PROFILE_FLOOD = 7
+KINKS_FLOOD = 13
+CHANNEL_NOT_FOUND = 26
+CHANNEL_INVITE_ONLY = 44
+CHANNEL_BANNED = 48
+
+
+class ServerError(Exception):
+    """An ERR frame answering a request."""
+
+    def __init__(self, message):
+        super().__init__(message.get('message'))
+        self.number = message.get('number')
+
+
+class RequestCorrelator(object):
+    """Matches server responses to the commands that asked for them.
+
+    Each response opcode is registered once with a key function extracting the correlation key
+    from a response, such as the channel name of a JCH. Pending requests are kept in a dict
+    keyed on (opcode, key), so a response is matched in O(1) however many requests are in flight.
+    Concurrent requests for the same key share the response. ERR frames carry no key, an error registered
+    for an opcode fails its oldest pending request, as the server answers commands in order.
+
+    :param default_timeout: Seconds before a pending request fails with asyncio.TimeoutError.
+    """
+
+    def __init__(self, protocol, default_timeout=30):
+        self.protocol = protocol
+        self.default_timeout = default_timeout
+        self.pending = {}
+        self.key_functions = {}
+        self.error_ops = {}
+        self._handles = {}
+        self._error_handle = None
+
+    def register(self, op, key_function):
+        """Correlate responses of op by key_function(message), which returns None for unrelated messages."""
+        self.key_functions[op] = key_function
+        if op not in self._handles:
+            self._handles[op] = self.protocol.add_op_callback(op, lambda message: self._on_response(op, message))
+
+    def register_errors(self, op, numbers):
+        """Fail the oldest pending request of op with a ServerError on an ERR with one of numbers."""
+        for number in numbers:
+            self.error_ops.setdefault(number, []).append(op)
+        if self._error_handle is None:
+            self._error_handle = self.protocol.add_op_callback(opcode.ERROR, self._on_error)
+
+    def _on_error(self, message):
+        if not self.pending or not isinstance(message, dict):
+            return
+        ops = self.error_ops.get(message.get('number'))
+        if not ops:
+            return
+        for op, key in self.pending:
+            if op in ops:
+                error = ServerError(message)
+                for future in self.pending.pop((op, key)):
+                    if not future.done():
+                        future.set_exception(error)
+                return
+
+    def _on_response(self, op, message):
+        if not self.pending:
+            return
+        try:
+            key = self.key_functions[op](message)
+        except (KeyError, TypeError):
+            return
+        futures = self.pending.pop((op, key), None)
+        if futures:
+            for future in futures:
+                if not future.done():
+                    future.set_result(message)
+
+    def _discard(self, op, key, future):
+        futures = self.pending.get((op, key))
+        if futures and future in futures:
+            futures.remove(future)
+            if not futures:
+                del self.pending[(op, key)]
+
+    def request(self, op, key, command=None, timeout=None, transform=None):
+        """Return a future resolving with the op response carrying key.
+        :param command: (opcode, data) to send, skipped when a request for the same key is already in flight.
+        :param timeout: Seconds to wait, defaults to default_timeout; None in both disables the timeout.
+        :param transform: f(message) applied to the response before it resolves the future.
+        """
+        loop = self.protocol.loop
+        future = loop.create_future()
+        waiters = self.pending.setdefault((op, key), [])
+        first = not waiters
+        waiters.append(future)
+
+        timeout = self.default_timeout if timeout is None else timeout
+        timer = loop.call_later(timeout, self._timeout, future) if timeout is not None else None
+
+        def done(f):
+            if timer is not None:
+                timer.cancel()
+            self._discard(op, key, f)
+
+        future.add_done_callback(done)
+        if first and command is not None:
+            self.protocol.message(*command)
+
+        if transform is None:
+            return future
+        result = loop.create_future()
+
+        def chain(f):
+            if result.done():
+                return
+            if f.cancelled():
+                result.cancel()
+            elif f.exception() is not None:
+                result.set_exception(f.exception())
+            else:
+                try:
+                    result.set_result(transform(f.result()))
+                except Exception as e:
+                    result.set_exception(e)
+
+        def cancel_source(r):
+            if r.cancelled():
+                future.cancel()
+
+        future.add_done_callback(chain)
+        result.add_done_callback(cancel_source)
+        return result
+
+    @staticmethod
+    def _timeout(future):
+        if not future.done():
+            future.set_exception(asyncio.TimeoutError())
+
+    def cancel_all(self):
+        for futures in list(self.pending.values()):
+            for future in list(futures):
+                future.cancel()
+        self.pending.clear()
+
+
+class StreamedRequests(object):
+    """Requests answered by a stream of frames, such as PRO answered by PRD start, info..., end.
+
+    The responses carry no correlation key, so one request is in flight at a time. Frames are only
+    collected after a start frame naming the requested character, so the late stream of a timed out
+    request is not mistaken for the next one. An ERR with one of the errors numbers before that start
+    frame fails the request, such as for an unknown character; other errors are left to their senders.
+    Concurrent requests for the same character share one server request and assembled results are cached.
+
+    :param result: f(character, fields) building the result from the collected key/value pairs.
+    :param errors: ERR numbers which answer request_op.
+    :param ttl: Seconds a result is cached.
+    :param timeout: Seconds to wait for a complete stream before moving on to the next request.
+    """
+
+    def __init__(self, protocol, request_op, response_op, result, errors=(CHARACTER_NOT_FOUND,), ttl=600,
+                 maxsize=512, timeout=30):
+        self.protocol = protocol
+        self.request_op = request_op
+        self.result = result
+        self.errors = frozenset(errors)
+        self.timeout = timeout
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.queue = collections.deque()
+        self.current = None
+        self._timer = None
+        self.handle = protocol.add_op_callback(response_op, self._on_response)
+        self.error_handle = protocol.add_op_callback(opcode.ERROR, self._on_error)
+
+    async def fetch(self, character):
+        """Assembled result for the character, from the cache when it is fresh."""
+        return await self.cache.get_or_fetch(str(character), partial(self._enqueue, str(character)))
+
+    def _enqueue(self, character):
+        future = self.protocol.loop.create_future()
+        self.queue.append((character, future))
+        if self.current is None:
+            self._next()
+        return future
+
+    def _next(self):
+        self.current = None
+        while self.queue:
+            character, future = self.queue.popleft()
+            if future.done():
+                continue
+            self.current = (character, future, None)
+            self._timer = self.protocol.loop.call_later(self.timeout, self._timed_out, future)
+            self.protocol.message(self.request_op, {'character': character})
+            return
+
+    def _timed_out(self, future):
+        if self.current is not None and self.current[1] is future:
+            future.set_exception(asyncio.TimeoutError())
+            self._next()
+
+    @staticmethod
+    def _names(message, character):
+        # Start frames read like "Profile of Hexxy", names are case insensitive.
+        text = str(message.get('message', '')).rstrip('.').lower()
+        return text == character.lower() or text.endswith(" " + character.lower())
+
+    def _finish(self, future, result=None, exception=None):
+        self._timer.cancel()
+        if not future.done():
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        self._next()
+
+    def _on_response(self, message):
+        if self.current is None or not isinstance(message, dict):
+            return
+        character, future, fields = self.current
+        kind = message.get('type')
+        if kind == 'start':
+            if self._names(message, character):
+                self.current = (character, future, {})
+        elif fields is None:
+            return  # Not our stream, such as the rest of a timed out one.
+        elif kind == 'end':
+            self._finish(future, self.result(character, fields))
+        elif 'key' in message:
+            fields[message['key']] = message.get('value')
+
+    def _on_error(self, message):
+        if self.current is None or self.current[2] is not None or not isinstance(message, dict):
+            return
+        if message.get('number') not in self.errors:
+            return
+        self._finish(self.current[1], exception=ServerError(message))
+
+    def close(self):
+        self.handle.remove()
+        self.error_handle.remove()
+        if self._timer is not None:
+            self._timer.cancel()
+        while self.queue:
+            self.queue.popleft()[1].cancel()
+        if self.current is not None:
+            self.current[1].cancel()
+            self.current = None
@@ -0,0 +1,54 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WireTrace(object):
+    """Logs raw frames going over the wire, one child logger per opcode.
+
+    Whether an opcode is traced is resolved once from the effective level of its
+    child logger and cached, a disabled opcode costs a single dict lookup per frame.
+    Call refresh() after changing logger levels at runtime.
+
+    :param logger: Parent logger, frames are logged to logger.getChild(opcode).
+    :param level: Level the frames are logged at.
+    :param max_length: Frames longer than this are truncated, None disables truncation.
+    :param sampling: dict of opcode to n; only every n-th frame of that opcode is logged.
+    """
+
+    def __init__(self, logger, level=logging.INFO, max_length=1024, sampling=None):
+        self.logger = logger
+        self.level = level
+        self.max_length = max_length
+        self.sampling = dict(sampling or {})
+        self._loggers = {}
+        self._counts = {}
+
+    def refresh(self):
+        """Forget cached enablement, picking up logger level changes."""
+        self._loggers.clear()
+
+    def _resolve(self, op):
+        child = self.logger.getChild(op)
+        enabled = child if child.isEnabledFor(self.level) else None
+        self._loggers[op] = enabled
+        return enabled
+
+    def __call__(self, direction, op, message):
+        try:
+            log = self._loggers[op]
+        except KeyError:
+            log = self._resolve(op)
+        if log is None:
+            return
+
+        every = self.sampling.get(op)
+        if every:
+            count = self._counts.get(op, 0)
+            self._counts[op] = count + 1
+            if count % every:
+                return
+
+        if self.max_length is not None and len(message) > self.max_length:
+            message = "%s... (%d characters)" % (message[:self.max_length], len(message))
+        log.log(self.level, "%s %s", direction, message)
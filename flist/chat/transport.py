@@ -4,6 +4,8 @@ import logging
 import aiohttp
 
 from flist.chat import opcode as opcode
+from flist.chat.inbound import InboundQueue
+from flist.codec import default_codec
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +14,7 @@ class TransportErrors:
     connection_closed = (0, "Websocket: Closed")
     connection_error = (-1, "Websocket: Error")
     connection_exception = (-2, "Websocket: Exception")
+    connection_timeout = (-3, "Websocket: Server stopped responding")
 
 
 class ConnectionCallbacks(object):
@@ -26,48 +29,122 @@ class ConnectionCallbacks(object):
 
 
 class WebsocketsClientAdapter(ConnectionCallbacks):
-    def __init__(self, url, loop=None):
+    """Websocket client; the reader only queues frames in an InboundQueue, which dispatches them to on_message."""
+
+    def __init__(self, url, loop=None, codec=None, session=None):
         super().__init__()
         self.url = url
         self.loop = loop or asyncio.get_event_loop()
-        self.session = aiohttp.ClientSession(loop=self.loop)
+        self.codec = codec or default_codec
+        self.websocket = None
+        self.reader = None
+        self._closing = False
+        self.inbound = InboundQueue(self.on_message, self.loop)
+        self.session = session or aiohttp.ClientSession(loop=self.loop, json_serialize=self.codec.dumps)
 
     def connect(self):
-        asyncio.ensure_future(self._connect_inputloop(), loop=self.loop)
+        self._closing = False
+        self.reader = asyncio.ensure_future(self._connect_inputloop(), loop=self.loop)
 
     def close(self):
-        asyncio.ensure_future(self.websocket.close(), loop=self.loop)
+        """Stop the reader, including one still connecting, and close the websocket."""
+        self._closing = True
+        self.inbound.clear()
+        if self.reader is not None and not self.reader.done() and self.reader is not asyncio.current_task(self.loop):
+            self.reader.cancel()
+        self.reader = None
+        if self.websocket is not None:
+            asyncio.ensure_future(self.websocket.close(), loop=self.loop)
+
+    def on_frame(self, message):
+        """Called by the reader for every text frame, before it waits for dispatch."""
+        self.inbound.put(message)
 
     async def _connect_inputloop(self):
+        websocket = None
         try:
             async with self.session.ws_connect(self.url) as websocket:
                 self.websocket = websocket
                 self.on_open()
-                async for message in self.websocket:
+                async for message in websocket:
                     if message.type == aiohttp.WSMsgType.text:
-                        self.on_message(message.data)
+                        self.on_frame(message.data)
+                        if self.inbound.full:
+                            await self.inbound.wait_for_space()
                     elif message.type == aiohttp.WSMsgType.closed:
-                        logger.warning("Websocket connection closed.")
-                        self.on_close(*TransportErrors.connection_closed)
                         break
                     elif message.type == aiohttp.WSMsgType.error:
                         logger.error("Websocket error")
                         self.on_close(*TransportErrors.connection_error)
-                        break
+                        return
+            if not self._closing:
+                # The server went away, a close() of our own is not reported.
+                logger.warning("Websocket connection closed.")
+                self.on_close(*TransportErrors.connection_closed)
+        except asyncio.CancelledError:
+            raise  # Stopped by close(), which is not reported.
         except:
             logger.exception("Websocket Exception was thrown")
             self.on_close(*TransportErrors.connection_exception)
         finally:
-            self.websocket = None
+            if self.websocket is websocket:
+                self.websocket = None  # Unless a newer reader has connected meanwhile.
 
     def send_message(self, message):
-        asyncio.ensure_future(self.websocket.send_str(message), loop=self.loop)
+        """Write a text frame, returns a future which resolves once it is written."""
+        if self.websocket is None:
+            raise ConnectionResetError("The websocket is not connected.")
+        return asyncio.ensure_future(self.websocket.send_str(message), loop=self.loop)
+
+
+class KeepaliveScheduler(object):
+    """Runs the keepalive checks of many pingers from a single timer, for connections sharing a loop."""
+
+    def __init__(self, loop, interval=45):
+        self.loop = loop
+        self.interval = interval
+        self.pingers = set()
+        self._timer = None
+
+    def add(self, pinger):
+        self.pingers.add(pinger)
+        if self._timer is None:
+            self._timer = self.loop.call_later(self.interval, self._tick)
+
+    def discard(self, pinger):
+        self.pingers.discard(pinger)
+        if not self.pingers and self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _tick(self):
+        self._timer = self.loop.call_later(self.interval, self._tick)
+        for pinger in list(self.pingers):
+            # noinspection PyBroadException
+            try:
+                pinger.check()
+            except Exception:
+                pass  # The pinger has logged it and closed its connection.
 
 
 class FChatPinger(WebsocketsClientAdapter):
-    def __init__(self, url, loop=None):
-        super().__init__(url, loop)
+    """Keeps the connection alive and notices when the server has gone silent.
+
+    A single timer fires every ping_interval seconds; a PIN is sent when nothing was sent since the
+    previous check, and the connection is closed when nothing was received for dead_timeout seconds.
+    Frames record activity as they are read, they do not touch the timer.
+    With a KeepaliveScheduler the checks run from its timer instead, which is shared with other connections.
+    """
+
+    def __init__(self, url, loop=None, codec=None, ping_interval=45, dead_timeout=120, session=None,
+                 keepalive=None):
+        super().__init__(url, loop, codec, session)
+        self.ping_interval = ping_interval
+        self.dead_timeout = dead_timeout
+        self.keepalive = keepalive
         self.pinger = None
+        self.last_received = None
+        self._sent = False
 
     def ping(self):
         try:
@@ -76,29 +153,63 @@ class FChatPinger(WebsocketsClientAdapter):
             logger.exception("Pinger met with exception.")
             self.on_close(*TransportErrors.connection_exception)
             raise
-        else:
-            self.pinger = self.loop.call_later(45, self.ping)
+
+    def _dead(self):
+        now = self.loop.time()
+        if self.dead_timeout is not None and now - self.last_received >= self.dead_timeout:
+            logger.warning("Nothing received from the server in %s seconds, closing.", self.dead_timeout)
+            self.on_close(*TransportErrors.connection_timeout)
+            if self.websocket is not None:
+                self.close()
+            return True
+        return False
+
+    def _keepalive(self):
+        if not self._sent:
+            self.ping()
+        self._sent = False
+
+    def check(self):
+        if not self._dead():
+            self._keepalive()
+
+    def _check(self):
+        if self._dead():
+            return
+        self.pinger = self.loop.call_later(self.ping_interval, self._check)
+        self._keepalive()
+
+    def _stop(self):
+        if self.pinger:
+            self.pinger.cancel()
+            self.pinger = None
+        if self.keepalive is not None:
+            self.keepalive.discard(self)
 
     def on_open(self):
-        self.pinger = self.loop.call_later(45, self.ping)
+        self.last_received = self.loop.time()
+        self._sent = False
+        if self.keepalive is not None:
+            self.keepalive.add(self)
+        else:
+            self.pinger = self.loop.call_later(self.ping_interval, self._check)
         super().on_open()
 
     def on_close(self, code, reason):
-        if self.pinger:
-            self.pinger.cancel()
+        self._stop()
         super().on_close(code, reason)
 
-    def on_message(self, message):
-        if self.pinger:
-            self.pinger.cancel()
-        self.pinger = self.loop.call_later(45, self.ping)
-        super().on_message(message)
+    def close(self):
+        self._stop()
+        super().close()
+
+    def on_frame(self, message):
+        self.last_received = self.loop.time()
+        super().on_frame(message)
 
     def send_message(self, message):
-        if self.pinger:
-            self.pinger.cancel()
-        self.pinger = self.loop.call_later(45, self.ping)
-        super().send_message(message)
+        self._sent = True
+        return super().send_message(message)
 
 
 class FChatTransport(ConnectionCallbacks):
@@ -0,0 +1,85 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class JSONCodec(object):
+    """Codec backed by the standard library json module, always available.
+
+    A codec provides loads(str) -> object and dumps(object) -> str,
+    decoding errors are raised as ValueError. Every codec writes the same compact frames.
+    """
+    name = "json"
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+class OrjsonCodec(object):
+    """Codec backed by orjson, when it is installed."""
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+        self._loads = orjson.loads
+        self._dumps = orjson.dumps
+
+    def loads(self, data):
+        return self._loads(data)
+
+    def dumps(self, obj):
+        return self._dumps(obj).decode('utf-8')
+
+
+class UjsonCodec(object):
+    """Codec backed by ujson, when it is installed."""
+    name = "ujson"
+
+    def __init__(self):
+        import ujson
+        self._loads = ujson.loads
+        self._dumps = ujson.dumps
+
+    def loads(self, data):
+        return self._loads(data)
+
+    def dumps(self, obj):
+        return self._dumps(obj, ensure_ascii=False)
+
+
+codecs = {
+    OrjsonCodec.name: OrjsonCodec,
+    UjsonCodec.name: UjsonCodec,
+    JSONCodec.name: JSONCodec,
+}
+
+
+def available_codecs():
+    """Return instances of every codec whose backend can be imported, fastest first."""
+    found = []
+    for factory in codecs.values():
+        try:
+            found.append(factory())
+        except ImportError:
+            pass
+    return found
+
+
+def get_codec(name=None):
+    """Return a codec instance.
+    :param name: Name of the codec backend, when omitted the fastest installed backend is used.
+    """
+    if name is not None:
+        return codecs[name]()
+    codec = available_codecs()[0]
+    logger.debug("Using the %s codec.", codec.name)
+    return codec
+
+
+default_codec = get_codec()
@@ -1,52 +1,112 @@
 import asyncio
 import logging
+import weakref
+from collections import namedtuple
+from collections.abc import MutableMapping
 from functools import partial
+from sys import intern
 
 import flist.chat.opcode as opcode
-from flist.aiter_provider import CountCloserProvider, CloserProvider
+from flist.aiter_provider import CountCloserProvider, CloserProvider, DROP_OLDEST
+from flist.chat.execution import collect
+from flist.chat.reconnect import Backoff
+from flist.chat.requests import (RequestCorrelator, StreamedRequests, CHARACTER_NOT_FOUND, PROFILE_FLOOD,
+                                 KINKS_FLOOD, CHANNEL_NOT_FOUND, CHANNEL_INVITE_ONLY, CHANNEL_BANNED)
+from flist.roster import Roster, RosterIngest, Memberships
 
 logger = logging.getLogger(__name__)
 
+# ERR number sent when the identification, and so the ticket, was refused.
+IDENTIFICATION_FAILED = 4
+
+
+Profile = namedtuple('Profile', ['character', 'fields'])
+Kinks = namedtuple('Kinks', ['character', 'kinks'])
+
 
 class Character:
+    __slots__ = ('name', 'chat', '__weakref__')
+
     def __init__(self, chat, name):
-        """Characters are initiated as they become known."""
-        self.name = str(name)
-        self.protocol = chat.protocol
+        """Characters are initiated as they become known, use Connection.get_character to share instances."""
+        self.name = intern(str(name))
+        self.chat = chat
 
     def __str__(self):
         return self.name
 
+    @property
+    def protocol(self):
+        return self.chat.protocol
+
+    @property
+    def online(self):
+        return self.name in self.chat.roster
+
+    @property
+    def gender(self):
+        entry = self.chat.roster.get(self.name)
+        return entry.gender if entry else None
+
+    @property
+    def status(self):
+        entry = self.chat.roster.get(self.name)
+        return entry.status if entry else "offline"
+
+    @property
+    def statusmsg(self):
+        entry = self.chat.roster.get(self.name)
+        return entry.statusmsg if entry else ""
+
+    @property
+    def channels(self):
+        """Names of our channels this character is in."""
+        return self.chat.memberships.character_channels(self.name)
+
     def account_ban(self):
-        self.protocol.message(opcode.ACCOUNT_BAN, {'character': self.name})
-        pass  # ACB { character: "character" }
+        # ACB { character: "character" }
+        return self.protocol.message(opcode.ACCOUNT_BAN, {'character': self.name})
 
     def make_op(self):
-        pass  # AOP { character: "character" }
+        # AOP { character: "character" }
+        return self.protocol.message(opcode.PROMOTE_GLOBAL_OP, {'character': self.name})
 
     def get_alts(self):
-        pass  # AWC { character: "character" }
+        # AWC { character: "character" }, answered with a SYS message.
+        return self.protocol.message(opcode.LIST_ALTS, {'character': self.name})
 
     def de_op(self):
-        pass  # DOP { character: "character" }
+        # DOP { character: "character" }
+        return self.protocol.message(opcode.DEMOTE_GLOBAL_OP, {'character': self.name})
 
     def ignore(self):
-        pass  # IGN { action: "add", character: "character" }
+        """Returns a future resolving with the server's IGN confirmation."""
+        # IGN { action: "add", character: "character" }
+        return self.chat.requests.request(opcode.IGNORE, ('add', self.name),
+                                          (opcode.IGNORE, {'action': 'add', 'character': self.name}))
 
     def notify_ignored(self):
-        pass  # IGN { action: "notify", character: "character" }
+        # IGN { action: "notify", character: "character" }
+        return self.protocol.message(opcode.IGNORE, {'action': 'notify', 'character': self.name})
 
     def unignore(self):
-        pass  # IGN { action: "delete", character: "character" }
+        """Returns a future resolving with the server's IGN confirmation."""
+        # IGN { action: "delete", character: "character" }
+        return self.chat.requests.request(opcode.IGNORE, ('delete', self.name),
+                                          (opcode.IGNORE, {'action': 'delete', 'character': self.name}))
 
     def ip_ban(self):
-        pass  # IPB { character: "character" }
+        # IPB { character: "character" }
+        return self.protocol.message(opcode.IP_BAN, {'character': self.name})
 
     def kick(self):
-        pass  # KIK { character: "character" }
+        # KIK { character: "character" }
+        return self.protocol.message(opcode.SERVER_KICK, {'character': self.name})
 
     def kinks(self):
-        pass  # KIN { character: "character" }
+        """Coroutine returning the character's Kinks, shared with concurrent requests and cached."""
+        # KIN { character: "character" } -> KID start, custom..., end
+        return self.chat.kinks.fetch(self.name)
 
     def send(self, message):
         self.protocol.message(
@@ -55,11 +115,9 @@ class Character:
         )
 
     def profile(self):
-        self.protocol.message(
-            opcode.PROFILE,
-            {'character': self.name}
-        )
-        pass  # PRO { character: "character" } -> PROFILE_DATA
+        """Coroutine returning the character's Profile, shared with concurrent requests and cached."""
+        # PRO { character: "character" } -> PRD start, info/select..., end
+        return self.chat.profiles.fetch(self.name)
 
     def reward(self):
         self.protocol.message(
@@ -67,14 +125,18 @@ class Character:
             {'character': self.name}
         )
 
-    def report(self):
-        pass  # SFC { action: "action", report: "report", character: "character" }
+    def report(self, report):
+        # SFC { action: "report", report: "report", character: "character" }
+        return self.protocol.message(opcode.REPORT, {'action': 'report', 'report': report, 'character': self.name})
 
     def timeout(self, duration, message):
-        pass  # TMO { character: "character",time: time, reason: "reason" } # Duration in minutes.
+        # TMO { character: "character", time: time, reason: "reason" } # Duration in minutes.
+        return self.protocol.message(opcode.ACCOUNT_TIMEOUT,
+                                     {'character': self.name, 'time': duration, 'reason': message})
 
     def unban(self):
-        pass  # UBN { character: "character" }
+        # UBN { character: "character" }
+        return self.protocol.message(opcode.ACCOUNT_UNBAN, {'character': self.name})
 
     def announce_typing(self, status):  # clear, paused, typing
         d = {'character': self.name, 'status': status}
@@ -84,6 +146,7 @@ class Character:
 class Channel:
     def __init__(self, chat, channel, mode=None, title=None):
         """Channels are initiated as they become known."""
+        self.chat = chat
         self.protocol = chat.protocol
         self.name = channel
         self.mode = mode
@@ -91,12 +154,17 @@ class Channel:
         self.description = ""
         self.operators = []
 
-        self.protocol.add_op_callback(opcode.CHANNEL_MESSAGE, self._channel_message)
-        self.protocol.add_op_callback(opcode.LIST_OPS, self._channel_operators)
-        self.protocol.add_op_callback(opcode.SET_CHANNEL_DESCRIPTION, self._channel_description)
+        chat.router.add_channel_callback(opcode.CHANNEL_MESSAGE, channel, self._channel_message)
+        chat.router.add_channel_callback(opcode.LIST_OPS, channel, self._channel_operators)
+        chat.router.add_channel_callback(opcode.SET_CHANNEL_DESCRIPTION, channel, self._channel_description)
 
         self.callbacks = []
 
+    @property
+    def members(self):
+        """Names of the characters in the channel, known once we have joined it."""
+        return self.chat.memberships.channel_members(self.name)
+
     def add_listener(self, callback):
         """Add a listener; accepts f(character, message)"""
         self.callbacks.append(callback)
@@ -108,20 +176,26 @@ class Channel:
         self.operators = message["oplist"]
 
     def _channel_description(self, message):
-        if message['channel'] == self.name:
-            self.description = message['description']
+        self.description = message['description']
 
     def _channel_message(self, message):
-        if message['channel'] == self.name:
-            for f in self.callbacks:
-                message.pop('channel')
-                f(self, **message)
+        if self.callbacks:
+            message = {k: v for k, v in message.items() if k != 'channel'}
+            return collect([f(self, **message) for f in self.callbacks])
+
+    def _command(self, op, character=None, **data):
+        data['channel'] = self.name
+        if character is not None:
+            data['character'] = str(character)
+        return self.protocol.message(op, data)
 
     def banlist(self):
-        pass  # CBL { channel: "channel" }
+        # CBL { channel: "channel" }, answered with a SYS message.
+        return self._command(opcode.BANLIST)
 
     def ban(self, character):
-        pass  # CBU { channel: "channel", character: "character" }
+        # CBU { channel: "channel", character: "character" }
+        return self._command(opcode.BAN, character)
 
     def set_description(self, new_description):
         # CDS { channel: "channel", description: "description" }
@@ -129,32 +203,40 @@ class Channel:
         self.protocol.message(opcode.SET_CHANNEL_DESCRIPTION, d)
 
     def invite(self, character):
-        pass  # CIU { channel: "channel", character: "character", title: "My very special channel" }
+        # CIU { channel: "channel", character: "character" }
+        return self._command(opcode.INVITE, character)
 
     def kick(self, character):
-        pass  # CKU { channel: "channel", character: "character" }
+        # CKU { channel: "channel", character: "character" }
+        return self._command(opcode.KICK, character)
 
     def make_op(self, character):
-        pass  # COA { channel: "channel", character: "character" }
+        # COA { channel: "channel", character: "character" }
+        return self._command(opcode.PROMOTE_OP, character)
 
-    def list_operators(self, character):
-        pass  # COL { channel: "channel" }
+    def list_operators(self):
+        """Returns a future resolving with the list of channel operators."""
+        # COL { channel: "channel" } -> COL { channel: "channel", oplist: [...] }
+        return self.chat.requests.request(opcode.LIST_OPS, self.name, (opcode.LIST_OPS, {'channel': self.name}),
+                                          transform=lambda message: message['oplist'])
 
     def remove_op(self, character):
-        pass  # COR { channel: "channel", character: "character" }
+        # COR { channel: "channel", character: "character" }
+        return self._command(opcode.DEMOTE_OP, character)
 
     def unban(self, character):
-        pass  # CUB { channel: "channel", character: "character" }
+        # CUB { channel: "channel", character: "character" }
+        return self._command(opcode.UNBAN, character)
 
     def part(self):
-        d = {'channel': self.name}
-        self.protocol.message(opcode.LEAVE_CHANNEL, d)
-        pass  # LCH { channel: "channel" }
+        # LCH { channel: "channel" }
+        return self._command(opcode.LEAVE_CHANNEL)
 
     def join(self):
+        """Returns a future resolving with the server's JCH confirmation for our own character."""
         # JCH { channel: "channel" }     JCH {"character": {"identity": "Hexxy"}, "channel": "Frontpage"}
-        d = {'channel': self.name}
-        self.protocol.message(opcode.JOIN_CHANNEL, d)
+        return self.chat.requests.request(opcode.JOIN_CHANNEL, self.name,
+                                          (opcode.JOIN_CHANNEL, {'channel': self.name}))
 
     def send(self, message):
         # MSG { channel: "channel", message: "message" }
@@ -163,13 +245,131 @@ class Channel:
         self.protocol.message(opcode.CHANNEL_MESSAGE, d)
 
     def advertise_channel(self):
-        pass  # RAN { channel: "channel" }
+        # RAN { channel: "channel" }
+        return self._command(opcode.ADVERTISE_CHANNEL)
 
     def roll(self, dice):
-        pass  # RLL { channel: "channel", dice: "1d10" }
+        # RLL { channel: "channel", dice: "1d10" }
+        return self._command(opcode.ROLL, dice=dice)
 
     def set_status(self, status):
-        pass  # RST { channel: "channel", status: "status" } ("private", "public")
+        # RST { channel: "channel", status: "status" } ("private", "public")
+        return self._command(opcode.SET_PRIVATE_CHANNEL_STATE, status=status)
+
+
+ChannelListing = namedtuple('ChannelListing', ['name', 'title', 'mode', 'characters'])
+
+
+class ChannelTable(MutableMapping):
+    """Channel listings received through CHA/ORS, keyed by channel name.
+
+    Listings are kept as plain records, a Channel is only built the first time it is looked up.
+    Refreshing the listing replaces the records but keeps channels that were already built.
+    """
+
+    def __init__(self, chat):
+        self.chat = chat
+        self.listings = {}
+        self.channels = {}
+
+    def update_listings(self, channels):
+        self.listings = {
+            chan['name']: ChannelListing(chan['name'], chan.get('title', chan['name']),
+                                         chan.get('mode'), chan.get('characters', 0))
+            for chan in channels
+        }
+
+    def listing(self, name):
+        """Return the listing record for a channel without building the Channel."""
+        return self.listings[name]
+
+    def is_materialized(self, name):
+        return name in self.channels
+
+    def __getitem__(self, name):
+        try:
+            return self.channels[name]
+        except KeyError:
+            listing = self.listings[name]
+        channel = Channel(self.chat, listing.name, mode=listing.mode, title=listing.title)
+        self.channels[name] = channel
+        return channel
+
+    def __setitem__(self, name, channel):
+        self.channels[name] = channel
+
+    def __delitem__(self, name):
+        found = self.listings.pop(name, None) is not None
+        if self.channels.pop(name, None) is not None:
+            self.chat.router.remove_channel(name)
+            found = True
+        if not found:
+            raise KeyError(name)
+
+    def __contains__(self, name):
+        return name in self.channels or name in self.listings
+
+    def __iter__(self):
+        yield from self.listings
+        for name in self.channels:
+            if name not in self.listings:
+                yield name
+
+    def __len__(self):
+        return len(self.listings) + sum(1 for name in self.channels if name not in self.listings)
+
+
+class ChannelRouter:
+    """Delivers channel scoped opcodes to the callbacks registered for that channel.
+
+    A single protocol callback is registered per opcode, the channel name of each
+    frame is then looked up in a dict instead of being offered to every channel.
+    """
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.routes = {}
+
+    def add_channel_callback(self, op, channel, callback):
+        """Callbacks take the form of f(message)"""
+        routes = self.routes.get(op)
+        if routes is None:
+            routes = self.routes[op] = {}
+            self.protocol.add_op_callback(op, partial(self._route, routes))
+        routes.setdefault(channel, []).append(callback)
+
+    def remove_channel_callback(self, op, channel, callback):
+        callbacks = self.routes.get(op, {}).get(channel)
+        if callbacks:
+            callbacks.remove(callback)
+            if not callbacks:
+                del self.routes[op][channel]
+
+    def remove_channel(self, channel):
+        for routes in self.routes.values():
+            routes.pop(channel, None)
+
+    @staticmethod
+    def _route(routes, message):
+        try:
+            channel = message['channel']
+            callbacks = routes.get(channel)
+        except (KeyError, TypeError):
+            return
+        if not callbacks:
+            return
+        # A failing callback only loses its own channel, the shared protocol callback stays registered.
+        results = []
+        for f in callbacks.copy():
+            # noinspection PyBroadException
+            try:
+                results.append(f(message))
+            except Exception:
+                callbacks.remove(f)
+                if not callbacks and routes.get(channel) is callbacks:
+                    del routes[channel]
+                logger.exception(f"Channel callback for {channel} failed and has been removed {f}")
+        return collect(results)
 
 
 class ItemEnricher:
@@ -178,87 +378,363 @@ class ItemEnricher:
 
     def __call__(self, message):
         enriched_message = message.copy()
-        self.callable(enriched_message)
+        return self.callable(enriched_message)
+
+
+class Watch:
+    """A watcher of one opcode with its declarative filters.
+
+    :param match: dict of field to an accepted value, or a set/list/tuple of accepted values.
+    :param prefix: dict of field to a prefix the field must start with.
+    """
+
+    def __init__(self, callback, match=None, prefix=None):
+        self.callback = callback
+        self.match = {}
+        for field, value in (match or {}).items():
+            self.match[field] = frozenset(value) if isinstance(value, (set, frozenset, list, tuple)) else frozenset([value])
+        self.prefix = dict(prefix or {})
+        # The first equality field is used to find this watcher through the index.
+        self.index_field = next(iter(self.match), None)
+
+    def accepts(self, message):
+        for field, values in self.match.items():
+            if field != self.index_field and message.get(field) not in values:
+                return False
+        for field, prefix in self.prefix.items():
+            value = message.get(field)
+            if not isinstance(value, str) or not value.startswith(prefix):
+                return False
+        return True
+
+
+class WatchIndex:
+    """Dispatches one opcode to its watchers, checking filters before anything is copied.
+
+    Watchers with an equality filter are indexed by the value they accept, so a message is only
+    offered to the watchers interested in its value instead of every watcher of the opcode.
+    """
+
+    def __init__(self, protocol, op):
+        self.protocol = protocol
+        self.op = op
+        self.unindexed = []
+        self.index = {}
+        self.watches = set()
+        self.handle = None
+
+    def __len__(self):
+        return len(self.watches)
+
+    def add(self, watch):
+        self.watches.add(watch)
+        if watch.index_field is None:
+            self.unindexed.append(watch)
+        else:
+            values = self.index.setdefault(watch.index_field, {})
+            for value in watch.match[watch.index_field]:
+                values.setdefault(value, []).append(watch)
+        if len(self) == 1:
+            self.handle = self.protocol.add_op_callback(self.op, self)
+
+    def remove(self, watch):
+        if watch not in self.watches:
+            return
+        self.watches.discard(watch)
+        if watch.index_field is None:
+            if watch in self.unindexed:
+                self.unindexed.remove(watch)
+        else:
+            values = self.index.get(watch.index_field, {})
+            for value in watch.match[watch.index_field]:
+                watchers = values.get(value)
+                if watchers and watch in watchers:
+                    watchers.remove(watch)
+                    if not watchers:
+                        del values[value]
+            if not values:
+                self.index.pop(watch.index_field, None)
+        if not len(self):
+            self.handle.remove()
+
+    def _candidates(self, message):
+        candidates = list(self.unindexed)
+        for field, values in self.index.items():
+            try:
+                watchers = values.get(message.get(field))
+            except TypeError:
+                continue  # Unhashable field value.
+            if watchers:
+                candidates.extend(watchers)
+        return candidates
+
+    def __call__(self, message):
+        if not isinstance(message, dict):
+            return None
+        pending = []
+        for watch in self._candidates(message):
+            if not watch.accepts(message):
+                continue
+            # noinspection PyBroadException
+            try:
+                r = watch.callback(message)
+            except BrokenPipeError:
+                self.remove(watch)  # Caused by a closed provider.
+                continue
+            except Exception:
+                self.remove(watch)
+                logger.exception(f"Watch callback failed and has been removed {watch.callback}")
+                continue
+            if r is not None:
+                pending.append(r)
+        if pending:
+            return asyncio.gather(*pending)
+        return None
+
+
+class CharacterRegistry(object):
+    """Hands out one shared Character per name for as long as it is referenced.
+
+    State such as status and gender is not kept on the Character, it is read from the roster.
+    """
+
+    def __init__(self, chat):
+        self.chat = chat
+        self.characters = weakref.WeakValueDictionary()
+
+    def __getitem__(self, name):
+        character = self.characters.get(name)
+        if character is None:
+            character = Character(self.chat, name)
+            self.characters[character.name] = character
+        return character
+
+    def __contains__(self, name):
+        return name in self.characters
+
+    def __len__(self):
+        return len(self.characters)
 
 
 class Connection(object):
     def __init__(self, protocol, character):
         self._closables = [protocol]
+        self._watch_indexes = {}
         self.character = character
-        self.public_channels = {}
-        self.private_channels = {}
-        self.characters = {}
+        self.public_channels = ChannelTable(self)
+        self.private_channels = ChannelTable(self)
+        self.characters = CharacterRegistry(self)
         self.variables = {}
+        self.roster = Roster()
+        self.roster_ingest = RosterIngest(self.roster, protocol.loop)
+        self.memberships = Memberships(character)
+        self.reconnect = None
+        self.reconnects = 0
+        self.recovery_time = None
+        self.connect_timeout = 30
+        self._protocol_handlers = None
+        self._reconnecting = None
+        self._rejoin = set()
+        self._lost_at = None
+        self._ticket = None
+        self._ticket_refused = False
 
         self.protocol = protocol
+        inbound = getattr(protocol.transport, 'inbound', None)
+        if inbound is not None:
+            inbound.shed_opcodes.discard(opcode.STATUS)  # The roster needs every status change.
+        self.router = ChannelRouter(protocol)
+        self.requests = RequestCorrelator(protocol)
+        self.requests.register(opcode.JOIN_CHANNEL, self._own_join_key)
+        self.requests.register(opcode.LIST_OPS, lambda message: message['channel'])
+        self.requests.register_errors(opcode.JOIN_CHANNEL, (CHANNEL_NOT_FOUND, CHANNEL_INVITE_ONLY, CHANNEL_BANNED))
+        self.requests.register_errors(opcode.LIST_OPS, (CHANNEL_NOT_FOUND,))
+        self.requests.register(opcode.IGNORE, lambda message: (message['action'], message['character']))
+        self.profiles = StreamedRequests(protocol, opcode.PROFILE, opcode.PROFILE_DATA, Profile,
+                                         errors=(CHARACTER_NOT_FOUND, PROFILE_FLOOD))
+        self.kinks = StreamedRequests(protocol, opcode.KINKS, opcode.KINKS_DATA, Kinks,
+                                      errors=(CHARACTER_NOT_FOUND, KINKS_FLOOD))
+        self._closables.extend([self.profiles, self.kinks])
+        self.protocol.add_op_callback(opcode.LIST_CHARACTERS, self.roster_ingest.on_list)
+        self.protocol.add_op_callback(opcode.USER_CONNECTED, self.roster_ingest.on_connected)
+        self.protocol.add_op_callback(opcode.GONE_OFFLINE, self.roster_ingest.on_offline)
+        self.protocol.add_op_callback(opcode.STATUS, self.roster_ingest.on_status)
+        self.protocol.add_op_callback(opcode.INITIAL_CHANNEL_DATA, self.memberships.on_initial)
+        self.protocol.add_op_callback(opcode.JOIN_CHANNEL, self.memberships.on_join)
+        self.protocol.add_op_callback(opcode.LEAVE_CHANNEL, self.memberships.on_leave)
+        self.protocol.add_op_callback(opcode.GONE_OFFLINE, self.memberships.on_offline)
         self.protocol.add_op_callback(opcode.LIST_OFFICAL_CHANNELS, self._update_public_channels)
         self.protocol.add_op_callback(opcode.LIST_PRIVATE_CHANNELS, self._update_private_channels)
         self.protocol.add_op_callback(opcode.VARIABLES, self._variables)
 
-    def connect(self):
-        deferrence = asyncio.Future()
-        o = self.protocol.on_open
-        c = self.protocol.on_close
+    @property
+    def roster_ready(self):
+        """Future resolving with the roster once the online list sent after identification is applied."""
+        return self.roster_ingest.ready
+
+    def connect(self, wait_for_roster=False, reconnect=False):
+        """Connect and identify, returns a future resolving with this connection.
+        :param wait_for_roster: Resolve only once the initial online list has been applied to the roster.
+        :param reconnect: Reconnect when the established connection drops, True or a Backoff giving the
+            delays between attempts. The ticket is reused, callbacks, listeners and watches stay subscribed,
+            the roster is rebuilt and the channels we were in are joined again.
+        """
+        if reconnect is True:
+            reconnect = Backoff()
+        self.reconnect = reconnect or None
+        self._protocol_handlers = (self.protocol.on_open, self.protocol.on_close)
+        return self._open(wait_for_roster)
+
+    def _open(self, wait_for_roster=False):
+        deferrence = self.protocol.loop.create_future()
+        opened, closed = self._protocol_handlers
 
         def on_open():
-            o()
+            opened()
             self._introduce()
-            self.protocol.on_close = c
 
         def on_connected(data):
-            try:
-                if data['identity'] == str(self.character):
-                    deferrence.set_result(self)
+            if deferrence.done():
+                return
+            if data['identity'] == str(self.character):
+                self.protocol.on_close = self._connection_lost
+                self.roster_ingest.complete()
+                if wait_for_roster:
+                    self.roster_ready.add_done_callback(
+                        lambda f: deferrence.done() or deferrence.set_result(self))
                 else:
-                    logger.error(data)
-                    deferrence.set_exception(Exception("Received invalid identity response."))
-            finally:
-                self.protocol.remove_op_callback(opcode.USER_CONNECTED, on_connected)
+                    deferrence.set_result(self)
+            else:
+                logger.error(data)
+                deferrence.set_exception(Exception("Received invalid identity response."))
+
+        def on_error(data):
+            # Before identification an error means we were refused, such as for an expired ticket.
+            if not deferrence.done():
+                self._ticket_refused = data.get('number') == IDENTIFICATION_FAILED
+                deferrence.set_exception(ConnectionRefusedError(data.get('message')))
 
         def on_close(code, reason):
-            c(code, reason)
-            deferrence.set_exception(ConnectionResetError(reason))
+            closed(code, reason)
+            if not deferrence.done():
+                deferrence.set_exception(ConnectionResetError(reason))
+                if self._reconnecting is None:
+                    self.protocol.outbound.fail(ConnectionResetError(reason))
+
+        def done(f):
+            handle.remove()
+            error_handle.remove()
 
         self.protocol.on_open = on_open
         self.protocol.on_close = on_close
-        self.protocol.add_op_callback(opcode.USER_CONNECTED, on_connected)
+        handle = self.protocol.add_op_callback(opcode.USER_CONNECTED, on_connected)
+        error_handle = self.protocol.add_op_callback(opcode.ERROR, on_error)
+        deferrence.add_done_callback(done)
         self.protocol.connect()
         return deferrence
 
+    def _connection_lost(self, code, reason):
+        self._protocol_handlers[1](code, reason)
+        if self.reconnect is None:
+            self.protocol.outbound.fail(ConnectionResetError(reason))
+            return
+        if self._reconnecting is not None:
+            return
+        logger.warning("Connection lost (%s), reconnecting.", reason)
+        self._lost_at = self.protocol.loop.time()
+        self._rejoin.update(self.memberships.character_channels(str(self.character)))
+        self.memberships.clear()
+        self.roster_ingest.reset()
+        self._reconnecting = asyncio.ensure_future(self._reconnect(), loop=self.protocol.loop)
+
+    async def _reconnect(self):
+        attempt = 0
+        while True:
+            await asyncio.sleep(self.reconnect.delay(attempt))
+            attempt += 1
+            if self._ticket_refused:
+                await self._renew_ticket()
+            try:
+                await asyncio.wait_for(self._open(), self.connect_timeout)
+                break
+            except (ConnectionError, asyncio.TimeoutError) as e:
+                logger.warning("Reconnect attempt %d failed: %r", attempt, e)
+                self.protocol.transport.close()
+        self._reconnecting = None
+        await self._join_again()
+        if self._reconnecting is None:
+            self.reconnects += 1
+            self.recovery_time = self.protocol.loop.time() - self._lost_at
+            logger.info("Reconnected after %.2f seconds and %d attempts.", self.recovery_time, attempt)
+
+    async def _renew_ticket(self):
+        self._ticket_refused = False
+        renew = getattr(self.character.account, 'renew_ticket', None)
+        if renew is not None:
+            try:
+                await renew(self._ticket)
+            except Exception:
+                logger.exception("Renewing the ticket failed.")
+
+    async def _join_again(self):
+        channels = list(self._rejoin)
+        results = await asyncio.gather(*[
+            self.requests.request(opcode.JOIN_CHANNEL, name, (opcode.JOIN_CHANNEL, {'channel': name}))
+            for name in channels], return_exceptions=True)
+        for name, result in zip(channels, results):
+            if isinstance(result, BaseException):
+                logger.warning("Could not join %s again: %r", name, result)
+            else:
+                self._rejoin.discard(name)
+
     def close(self):
         self.quit()
 
     def quit(self):
+        self.reconnect = None
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
         for c in self._closables:
             c.close()
+        self.requests.cancel_all()
         del self.protocol
+        del self.router
+        del self.requests
         del self.public_channels
         del self.private_channels
         del self.variables
         del self.characters
+        del self.roster
+        del self.memberships
         del self.character
 
+    def _own_join_key(self, message):
+        if message['character']['identity'] == str(self.character):
+            return message['channel']
+        return None
+
+    def get_character(self, name):
+        return self.characters[name]
+
     def _variables(self, var):
         self.variables[var['variable']] = var['value']
+        self.protocol.outbound.set_variable(var['variable'], var['value'])
 
-    def _update_channels(self, update_list, channel_list):
+    def _update_channels(self, channel_table, channel_list):
         # {"channels":[{"name":"Dragons","mode":"both","characters":0},{"name":"Frontpage"
         #               ,"mode":"both","characters":0}, ... ]}
         # {"channels":[{"name":"ADH-********", "title": "Fuckit", "characters": 0}, ...]}
         channels = channel_list.get('channels', [])
         if channels:
-            for chan in channels:
-                if chan['name'] not in update_list:
-                    chan.pop('characters')
-                    c = Channel(self, **chan)
-                    update_list[chan['name']] = c
+            channel_table.update_listings(channels)
         else:
             logger.error("Channel response without any channels.")
 
     def _introduce(self):
+        self._ticket = self.character.account.ticket
         data = {
             'method': 'ticket',
-            'ticket': self.character.account.ticket,
+            'ticket': self._ticket,
             'account': str(self.character.account),
             'character': str(self.character),
             'cname': "StormyDragons F-List Python client (stormweyr.dk)",
@@ -280,24 +756,22 @@ class Connection(object):
         self.protocol.message(opcode.CREATE_PRIVATE_CHANNEL, {'channel': channelname})
 
     def join(self, channelname):
-        d = asyncio.Future()
-
-        channel = self.public_channels.get(channelname, None)
-        if channel:
-            d.set_result(channel)
+        # Listed channels are materialized on access, only skip the JCH when we are already in the channel.
+        if (self.public_channels.is_materialized(channelname)
+                and self.memberships.is_member(channelname, str(self.character))):
+            d = self.protocol.loop.create_future()
+            d.set_result(self.public_channels[channelname])
             return d
 
         def on_join(channel_data):
-            if channel_data['channel'] == channelname:
-                self.protocol.remove_op_callback(opcode.JOIN_CHANNEL, on_join)
-                channel_data.pop('character')
-                channel = Channel(self, **channel_data)
-                self.public_channels[channelname] = channel
-                d.set_result(channel)
+            if self.public_channels.is_materialized(channelname):
+                return self.public_channels[channelname]  # Built by a concurrent join.
+            channel = Channel(self, channel_data['channel'], title=channel_data.get('title'))
+            self.public_channels[channelname] = channel
+            return channel
 
-        self.protocol.add_op_callback(opcode.JOIN_CHANNEL, on_join)
-        self.protocol.message(opcode.JOIN_CHANNEL, {'channel': channelname})
-        return d
+        return self.requests.request(opcode.JOIN_CHANNEL, channelname,
+                                     (opcode.JOIN_CHANNEL, {'channel': channelname}), transform=on_join)
 
     def update_global_channels(self):
         # CHA
@@ -337,12 +811,28 @@ class Connection(object):
     def uptime(self):
         self.protocol.message(opcode.UPTIME)
 
-    def watch(self, opcode_, *, count=None):
-        closer = partial(self.protocol.remove_op_callback, opcode_)
+    def watch(self, opcode_, *, count=None, maxsize=None, overflow=DROP_OLDEST, key=None, match=None, prefix=None):
+        """Async iterator over the messages of an opcode.
+        :param count: Stop after this many messages.
+        :param maxsize: Bound on the messages buffered for a slow consumer, see flist.aiter_provider.Provider
+            for the overflow policies and key.
+        :param match: Only deliver messages whose fields equal these values, dict of field to a value or
+            a set of values, such as {'channel': {'Frontpage', 'Development'}}.
+        :param prefix: Only deliver messages whose fields start with these strings, such as {'message': '!roll'}.
+        """
+        index = self._watch_indexes.get(opcode_)
+        if index is None:
+            index = self._watch_indexes[opcode_] = WatchIndex(self.protocol, opcode_)
+
+        def closer(provider):
+            index.remove(watcher)
+
+        options = dict(closer=closer, maxsize=maxsize, overflow=overflow, key=key)
         if count:
-            provider = CountCloserProvider(closer=closer, count=count)
+            provider = CountCloserProvider(count=count, **options)
         else:
-            provider = CloserProvider(closer=closer)
-        self.protocol.add_op_callback(opcode_, ItemEnricher(provider.put_item))
+            provider = CloserProvider(**options)
+        watcher = Watch(ItemEnricher(provider.put_item), match=match, prefix=prefix)
+        index.add(watcher)
         self._closables.append(provider)
         return provider
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+from collections import namedtuple
+
+import aiohttp
+
+from flist.aiter_provider import CloserProvider, DROP_OLDEST
+from flist.chat.protocol import FChatProtocol
+from flist.chat.transport import DefaultFChatTransport, KeepaliveScheduler
+from flist.codec import default_codec
+from flist.fchat import Connection
+
+logger = logging.getLogger(__name__)
+
+ConnectionStats = namedtuple('ConnectionStats', [
+    'received', 'shed', 'inbound_depth', 'sent', 'outbound_depth',
+    'callbacks', 'tasks_running', 'tasks_queued', 'reconnects',
+])
+
+
+class ConnectionManager(object):
+    """Hosts the connections of many characters on one event loop.
+
+    The connections share one aiohttp session, one codec and one keepalive timer. Connection attempts
+    are spaced connect_interval seconds apart so a host starting dozens of characters does not trip the
+    server's connection limits. Flood limits are enforced by the server per connection, so every
+    connection keeps its own outbound queue.
+
+    watch() streams an opcode of all connections, stats() reports the traffic and work of each of them.
+
+    :param connect_interval: Minimum seconds between the start of two connection attempts.
+    """
+
+    def __init__(self, url="wss://chat.f-list.net/chat2", loop=None, codec=None, ping_interval=45,
+                 dead_timeout=120, connect_interval=1.0):
+        self.url = url
+        self.loop = loop or asyncio.get_event_loop()
+        self.codec = codec or default_codec
+        self.dead_timeout = dead_timeout
+        self.connect_interval = connect_interval
+        self.keepalive = KeepaliveScheduler(self.loop, ping_interval)
+        self.connections = {}
+        self.session = None
+        self._streams = []
+        self._connect_lock = None
+        self._last_connect = None
+
+    def _session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(json_serialize=self.codec.dumps)
+        return self.session
+
+    async def start(self, character, wait_for_roster=False, reconnect=True):
+        """Connect a character, returns its Connection once identified.
+        :param reconnect: See Connection.connect, hosted connections reconnect by default.
+        """
+        name = str(character)
+        if name in self.connections:
+            raise ValueError("%s is already connected." % name)
+        transport = DefaultFChatTransport(self.url, loop=self.loop, codec=self.codec, dead_timeout=self.dead_timeout,
+                                          session=self._session(), keepalive=self.keepalive)
+        connection = Connection(FChatProtocol(transport, loop=self.loop), character)
+        self.connections[name] = connection
+        for stream in self._streams:
+            self._subscribe(name, connection, stream)
+        try:
+            await self._wait_for_turn()
+            await connection.connect(wait_for_roster=wait_for_roster, reconnect=reconnect)
+        except BaseException:
+            self.remove(name)
+            raise
+        return connection
+
+    async def _wait_for_turn(self):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._last_connect is not None:
+                await asyncio.sleep(self._last_connect + self.connect_interval - self.loop.time())
+            self._last_connect = self.loop.time()
+
+    def remove(self, name):
+        """Disconnect and forget the connection of a character."""
+        connection = self.connections.pop(name)
+        for stream in self._streams:
+            handle = stream[2].pop(name, None)
+            if handle is not None:
+                handle.remove()
+        connection.quit()
+
+    @staticmethod
+    def _subscribe(name, connection, stream):
+        op, provider, handles = stream
+        handles[name] = connection.protocol.add_op_callback(op, lambda message: provider.put_item((connection, message)))
+
+    def watch(self, opcode_, *, maxsize=None, overflow=DROP_OLDEST, key=None):
+        """Async iterator over (connection, message) for the messages of an opcode on every hosted connection,
+        including connections started later. See Connection.watch for maxsize, overflow and key."""
+        def closer(provider):
+            self._streams.remove(stream)
+            for handle in stream[2].values():
+                handle.remove()
+
+        provider = CloserProvider(closer=closer, maxsize=maxsize, overflow=overflow, key=key)
+        stream = (opcode_, provider, {})
+        self._streams.append(stream)
+        for name, connection in self.connections.items():
+            self._subscribe(name, connection, stream)
+        return provider
+
+    def stats(self):
+        """ConnectionStats of every hosted connection, keyed by character name."""
+        return {name: self._stats(connection) for name, connection in self.connections.items()}
+
+    @staticmethod
+    def _stats(connection):
+        protocol = connection.protocol
+        inbound = protocol.transport.inbound
+        return ConnectionStats(
+            received=inbound.received,
+            shed=inbound.shed,
+            inbound_depth=inbound.depth(),
+            sent=protocol.outbound.sent,
+            outbound_depth=protocol.outbound.depth(),
+            callbacks=sum(len(callbacks) for callbacks in protocol.callbacks.values()),
+            tasks_running=protocol.execution.running,
+            tasks_queued=protocol.execution.queued,
+            reconnects=connection.reconnects,
+        )
+
+    async def close(self):
+        for stream in list(self._streams):
+            stream[1].close()
+        for name in list(self.connections):
+            self.remove(name)
+        if self.session is not None:
+            await self.session.close()
@@ -0,0 +1,313 @@
+import collections
+import logging
+from collections import namedtuple
+from sys import intern
+
+logger = logging.getLogger(__name__)
+
+RosterEntry = namedtuple('RosterEntry', ['name', 'gender', 'status', 'statusmsg'])
+
+ONLINE = "online"
+OFFLINE = "offline"
+STATUS_CHANGED = "status"
+
+
+class Roster(object):
+    """The characters currently online, fed from LIS, NLN, FLN and STA.
+
+    Characters are indexed by name, status and gender so membership tests are O(1)
+    and status or gender queries are O(result). Names, genders and statuses are interned
+    so every mention of a character across the connection shares one string.
+
+    add_listener: accepts f(event, entry) called with ONLINE, OFFLINE or STATUS_CHANGED
+    and the entry after the change (the last known entry for OFFLINE).
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.by_status = {}
+        self.by_gender = {}
+        self.listeners = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    def get(self, name, default=None):
+        return self.entries.get(name, default)
+
+    def with_status(self, status):
+        """Names of online characters with the given status."""
+        return frozenset(self.by_status.get(status, ()))
+
+    def with_gender(self, gender):
+        """Names of online characters with the given gender."""
+        return frozenset(self.by_gender.get(gender, ()))
+
+    def count_status(self, status):
+        return len(self.by_status.get(status, ()))
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self.listeners.remove(callback)
+
+    def _notify(self, event, entry):
+        for f in self.listeners:
+            # noinspection PyBroadException
+            try:
+                f(event, entry)
+            except Exception:
+                logger.exception("Roster listener %s failed.", f)
+
+    @staticmethod
+    def _index(index, key, name):
+        names = index.get(key)
+        if names is None:
+            names = index[key] = set()
+        names.add(name)
+
+    @staticmethod
+    def _unindex(index, key, name):
+        names = index.get(key)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del index[key]
+
+    def add(self, name, gender, status, statusmsg=""):
+        previous = self.entries.get(name)
+        if previous is not None:
+            self._unindex(self.by_status, previous.status, name)
+            self._unindex(self.by_gender, previous.gender, name)
+        name = intern(name)
+        entry = RosterEntry(name, intern(gender), intern(status), statusmsg or "")
+        self.entries[name] = entry
+        self._index(self.by_status, entry.status, name)
+        self._index(self.by_gender, entry.gender, name)
+        if self.listeners:
+            self._notify(ONLINE if previous is None else STATUS_CHANGED, entry)
+        return entry
+
+    def remove(self, name):
+        entry = self.entries.pop(name, None)
+        if entry is not None:
+            self._unindex(self.by_status, entry.status, name)
+            self._unindex(self.by_gender, entry.gender, name)
+            if self.listeners:
+                self._notify(OFFLINE, entry)
+        return entry
+
+    def set_status(self, name, status, statusmsg=""):
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        if entry.status != status:
+            status = intern(status)
+            self._unindex(self.by_status, entry.status, entry.name)
+            self._index(self.by_status, status, entry.name)
+        else:
+            status = entry.status
+        entry = self.entries[entry.name] = entry._replace(status=status, statusmsg=statusmsg or "")
+        if self.listeners:
+            self._notify(STATUS_CHANGED, entry)
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+        self.by_status.clear()
+        self.by_gender.clear()
+
+    # Protocol callbacks
+    def on_list(self, message):
+        # LIS {"characters": [["Alexandrea", "Female", "online", ""], ...]}
+        for character in (message or {}).get('characters', ()):
+            self.add(*character[:4])
+
+    def on_connected(self, message):
+        # NLN {"identity": "Hexxy", "gender": "Male", "status": "online"}
+        self.add(message['identity'], message['gender'], message['status'])
+
+    def on_offline(self, message):
+        # FLN {"character": "Hexxy"}
+        self.remove(message['character'])
+
+    def on_status(self, message):
+        # STA {"status": "looking", "statusmsg": "I'm always available to RP :)", "character": "Hexxy"}
+        self.set_status(message['character'], message['status'], message.get('statusmsg', ""))
+
+
+class RosterIngest(object):
+    """Feeds the roster from the protocol without blocking the loop on the initial LIS flood.
+
+    LIS frames are applied chunk_size characters at a time, handing control back to the loop between chunks.
+    NLN, FLN and STA frames arriving while LIS data is still pending are queued behind it, so the roster
+    sees every event in arrival order.
+
+    ready: future which resolves with the roster once complete() was called and everything is applied.
+    """
+
+    def __init__(self, roster, loop, chunk_size=500):
+        self.roster = roster
+        self.loop = loop
+        self.chunk_size = chunk_size
+        self.pending = collections.deque()
+        self.ready = loop.create_future()
+        self._complete = False
+        self._scheduled = False
+
+    def _apply(self, function, message):
+        if self.pending:
+            self.pending.append((function, message))
+        else:
+            function(message)
+
+    def on_list(self, message):
+        characters = (message or {}).get('characters')
+        if characters:
+            self.pending.append((None, iter(characters)))
+            self._schedule()
+
+    def on_connected(self, message):
+        self._apply(self.roster.on_connected, message)
+
+    def on_offline(self, message):
+        self._apply(self.roster.on_offline, message)
+
+    def on_status(self, message):
+        self._apply(self.roster.on_status, message)
+
+    def complete(self):
+        """Mark the initial flood as received, ready resolves once it has been applied."""
+        self._complete = True
+        self._check_ready()
+
+    def reset(self):
+        """Start over for a new session, emptying the roster."""
+        self.pending.clear()
+        self.roster.clear()
+        self._complete = False
+        if self.ready.done():
+            self.ready = self.loop.create_future()
+
+    def _check_ready(self):
+        if self._complete and not self.pending and not self.ready.done():
+            self.ready.set_result(self.roster)
+
+    def _schedule(self):
+        if not self._scheduled:
+            self._scheduled = True
+            self.loop.call_soon(self._step)
+
+    def _step(self):
+        self._scheduled = False
+        budget = self.chunk_size
+        add = self.roster.add
+        try:
+            while self.pending and budget > 0:
+                function, item = self.pending[0]
+                if function is not None:
+                    self.pending.popleft()
+                    function(item)
+                    budget -= 1
+                    continue
+                for character in item:
+                    add(*character[:4])
+                    budget -= 1
+                    if budget == 0:
+                        break
+                else:
+                    self.pending.popleft()
+        finally:
+            if self.pending:
+                self._schedule()
+            else:
+                self._check_ready()
+
+
+class Memberships(object):
+    """Who is in which of our channels, fed from ICH, JCH, LCH and FLN.
+
+    Keeps the member set of every channel and the reverse index of the channels each character is in,
+    so removing a character everywhere or listing their channels is O(channels of the character).
+    Only channels we are in are tracked, and empty sets are dropped, so memory follows actual memberships.
+
+    :param identity: Name of our own character; when we leave a channel it is forgotten entirely.
+    """
+
+    def __init__(self, identity):
+        self.identity = str(identity)
+        self.members = {}
+        self.channels_of = {}
+
+    def channel_members(self, channel):
+        return frozenset(self.members.get(channel, ()))
+
+    def character_channels(self, name):
+        return frozenset(self.channels_of.get(name, ()))
+
+    def is_member(self, channel, name):
+        return name in self.members.get(channel, ())
+
+    def add(self, channel, name):
+        name = intern(name)
+        self.members.setdefault(channel, set()).add(name)
+        self.channels_of.setdefault(name, set()).add(channel)
+
+    def discard(self, channel, name):
+        members = self.members.get(channel)
+        if members is not None:
+            members.discard(name)
+        channels = self.channels_of.get(name)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del self.channels_of[name]
+
+    def forget_channel(self, channel):
+        for name in self.members.pop(channel, ()):
+            channels = self.channels_of.get(name)
+            if channels is not None:
+                channels.discard(channel)
+                if not channels:
+                    del self.channels_of[name]
+
+    def remove_character(self, name):
+        for channel in self.channels_of.pop(name, ()):
+            members = self.members.get(channel)
+            if members is not None:
+                members.discard(name)
+
+    def clear(self):
+        self.members.clear()
+        self.channels_of.clear()
+
+    # Protocol callbacks
+    def on_initial(self, message):
+        # ICH {"users": [{"identity": "Shadlor"}, {"identity": "Bunnie Patcher"}], "channel": "Frontpage", "mode": "chat"}
+        channel = message['channel']
+        self.forget_channel(channel)
+        self.members[channel] = set()
+        for user in message.get('users', ()):
+            self.add(channel, user['identity'])
+
+    def on_join(self, message):
+        # JCH {"character": {"identity": "Hexxy"}, "channel": "Frontpage", "title": "Frontpage"}
+        self.add(message['channel'], message['character']['identity'])
+
+    def on_leave(self, message):
+        # LCH {"channel": "Frontpage", "character": "Hexxy"}
+        if message['character'] == self.identity:
+            self.forget_channel(message['channel'])
+        else:
+            self.discard(message['channel'], message['character'])
+
+    def on_offline(self, message):
+        # FLN {"character": "Hexxy"}
+        self.remove_character(message['character'])
@@ -1,6 +1,10 @@
 import unittest
 import asyncio
+import threading
+from unittest.mock import patch
+
 import flist.api
+import flist.codec
 
 
 class TestFListAPI(unittest.TestCase):
@@ -18,3 +22,154 @@ class TestFListAPI(unittest.TestCase):
         self.assertIsInstance(result, dict, "The result must be a dict.")
         self.assertTrue('error' in result, "The dict must contain a key named 'error'.")
         self.assertIsInstance(result['error'], str, "The dict must contain a string on it's error key.")
+
+    def test_client_reuses_session(self):
+        client = flist.api.APIClient(limit=2)
+
+        async def sessions():
+            first, second = client.session, client.session
+            limit = first.connector.limit
+            await client.close()
+            return first, second, limit
+
+        first, second, limit = asyncio.get_event_loop().run_until_complete(sessions())
+        self.assertIs(first, second, "The client keeps one session for all calls.")
+        self.assertEqual(limit, 2, "The connection limit is applied to the connector.")
+        self.assertTrue(first.closed)
+
+    def test_module_codec(self):
+        codec = flist.codec.get_codec('json')
+        with patch.object(flist.api, 'codec', codec):
+            self.assertIs(flist.api.default_client.codec, codec, "Clients without a codec use the module codec.")
+        own = flist.api.APIClient(codec=codec)
+        self.assertIs(own.codec, codec)
+
+    def test_session_per_loop(self):
+        client = flist.api.APIClient()
+
+        async def session(close=False):
+            current = client.session
+            if close:
+                await client.close()
+            return current
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        first = loop.run_until_complete(session(close=True))
+        self.assertTrue(first.closed)
+        second = loop.run_until_complete(session())
+
+        other = asyncio.new_event_loop()
+        self.addCleanup(other.close)
+        with self.assertLogs('flist.api', 'WARNING'):
+            third = other.run_until_complete(session(close=True))
+        self.assertIsNot(third, second, "Every loop gets its own session.")
+        self.assertFalse(second.closed, "Nothing is scheduled on a loop which is not running.")
+        loop.run_until_complete(second.close())
+
+        running = threading.Thread(target=loop.run_forever)
+        running.start()
+        try:
+            fourth = asyncio.run_coroutine_threadsafe(session(), loop).result()
+            other.run_until_complete(session(close=True))
+            asyncio.run_coroutine_threadsafe(asyncio.sleep(0.01), loop).result()
+            self.assertTrue(fourth.closed, "A session is closed on its loop while that loop runs.")
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            running.join()
+
+
+class CountingClient(flist.api.APIClient):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.posts = []
+
+    async def post(self, url, data):
+        self.posts.append(url)
+        await asyncio.sleep(0)
+        return {'error': '', 'name': data.get('name')}
+
+
+class TestAPICache(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+        self.client = CountingClient()
+
+    def test_concurrent_requests_are_deduplicated(self):
+        requests = [flist.api.character_info(client=self.client, account="a", ticket=str(i), name="Hexxy")
+                    for i in range(3)]
+        results = self.loop.run_until_complete(asyncio.gather(*requests))
+        self.assertEqual(len(self.client.posts), 1, "Identical requests share one fetch.")
+        self.assertEqual([r['name'] for r in results], ["Hexxy"] * 3)
+
+        cached = self.loop.run_until_complete(flist.api.character_info(client=self.client, account="a", name="Hexxy"))
+        self.assertEqual(len(self.client.posts), 1, "The response is served from the cache.")
+        cached['name'] = "Changed"
+        self.assertIsNot(results[0], results[1], "Every caller gets its own copy.")
+        self.assertEqual(self.loop.run_until_complete(
+            flist.api.character_info(client=self.client, account="a", name="Hexxy"))['name'], "Hexxy")
+
+        self.loop.run_until_complete(flist.api.character_info(client=self.client, account="b", name="Hexxy"))
+        self.assertEqual(len(self.client.posts), 2, "Accounts do not share responses.")
+
+        self.client.cache.invalidate('character_info', account="a", name="Hexxy")
+        self.loop.run_until_complete(flist.api.character_info(client=self.client, account="a", name="Hexxy"))
+        self.assertEqual(len(self.client.posts), 3, "Invalidated responses are fetched again.")
+
+    def test_uncached_endpoints(self):
+        for _ in range(2):
+            self.loop.run_until_complete(flist.api.bookmark_list(client=self.client, account="a", ticket="t"))
+            self.loop.run_until_complete(flist.api.kink_list(client=self.client, account="a", ticket="t"))
+        self.assertEqual(len(self.client.posts), 3, "Only read-only endpoints are cached.")
+
+        client = CountingClient(cache=False)
+        for _ in range(2):
+            self.loop.run_until_complete(flist.api.kink_list(client=client))
+        self.assertEqual(len(client.posts), 2)
+
+
+class TestFetchMany(unittest.TestCase):
+    class SlowClient(CountingClient):
+        async def post(self, url, data):
+            self.posts.append(data['name'])
+            self.in_flight = getattr(self, 'in_flight', 0) + 1
+            self.peak = max(getattr(self, 'peak', 0), self.in_flight)
+            await asyncio.sleep(0.001 * (5 - len(data['name'])))
+            self.in_flight -= 1
+            if data['name'] == "bad":
+                raise ValueError(data['name'])
+            return {'error': '', 'name': data['name']}
+
+    def collect(self, **kwargs):
+        async def run():
+            return [item async for item in flist.api.fetch_many(
+                flist.api.character_info, ["a", "bb", "bad", "cccc"], client=self.client, **kwargs)]
+
+        return asyncio.get_event_loop().run_until_complete(run())
+
+    def setUp(self):
+        self.client = self.SlowClient(cache=False)
+
+    def test_ordered_with_errors(self):
+        items = self.collect(concurrency=2, ordered=True)
+        self.assertEqual([item.name for item in items], ["a", "bb", "bad", "cccc"])
+        self.assertIsInstance(items[2].error, ValueError, "Failures are captured per item.")
+        self.assertEqual(items[3].result['name'], "cccc")
+        self.assertLessEqual(self.client.peak, 2, "Concurrency is bounded.")
+
+    def test_unordered_streams_all(self):
+        items = self.collect(concurrency=4)
+        self.assertEqual(sorted(item.name for item in items), ["a", "bad", "bb", "cccc"])
+
+    def test_failing_names(self):
+        def names():
+            yield "a"
+            yield "bb"
+            raise LookupError("The name source failed.")
+
+        async def run():
+            return [item async for item in flist.api.fetch_many(flist.api.character_info, names(), client=self.client)]
+
+        with self.assertRaises(LookupError):
+            asyncio.get_event_loop().run_until_complete(run())
+        self.assertEqual(sorted(self.client.posts), ["a", "bb"], "Requests already started still finish.")
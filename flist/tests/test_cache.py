@@ -0,0 +1,36 @@
+import unittest
+import asyncio
+
+from flist.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.cache = TTLCache(maxsize=2, ttl=10, clock=lambda: self.now)
+
+    def test_expiry(self):
+        self.cache.set("a", 1)
+        self.cache.set("forever", 2, ttl=None)
+        self.now = 9.0
+        self.assertEqual(self.cache.get("a"), 1)
+        self.now = 10.0
+        self.assertIsNone(self.cache.get("a"), "Entries expire after their time to live.")
+        self.assertEqual(self.cache.get("forever"), 2)
+
+    def test_lru_eviction(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertIn("a", self.cache)
+        self.assertNotIn("b", self.cache, "The least recently used entry is evicted.")
+
+    def test_failed_fetch_is_not_cached(self):
+        async def fail():
+            raise ValueError()
+
+        loop = asyncio.get_event_loop()
+        with self.assertRaises(ValueError):
+            loop.run_until_complete(self.cache.get_or_fetch("a", fail))
+        self.assertNotIn("a", self.cache)
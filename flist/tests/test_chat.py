@@ -1,13 +1,27 @@
 import unittest
 
 import asyncio
+import aiohttp
+import json
+import logging
 from unittest.mock import Mock, patch
 
 from flist.account import Character
+from flist.aiter_provider import BLOCK
 from flist.chat import opcode
+from flist.chat.inbound import InboundQueue
 from flist.chat.protocol import FChatProtocol
-from flist.chat.transport import FChatTransport, FChatPinger, TransportErrors
-from flist.fchat import Connection
+from flist.chat.reconnect import Backoff
+from flist.chat.requests import ServerError
+from flist.chat.trace import WireTrace
+from flist.chat.transport import (DefaultFChatTransport, FChatTransport, FChatPinger, TransportErrors,
+                                  WebsocketsClientAdapter)
+from flist.fchat import Channel, Connection, ItemEnricher
+from flist.manager import ConnectionManager
+
+
+def decoded(frames):
+    return [(frame[:3], json.loads(frame[4:])) for frame in frames]
 
 
 class MockTransport(FChatTransport):
@@ -18,6 +32,12 @@ class MockTransport(FChatTransport):
         pass
 
 
+class QueuedMockTransport(MockTransport):
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.inbound = InboundQueue(self.on_message, asyncio.get_event_loop(), **kwargs)
+
+
 class MockAccount(object):
     def __init__(self):
         self.characters = {'Adamoraco': Character('Adamoraco', self)}
@@ -56,6 +76,69 @@ class TestFChatProtocol(unittest.TestCase):
         self.mocktransport.on_message("""NLN {}""")
         self.assertEqual(result, None, "Callback should have been removed.")
 
+    def test_unsubscribe_during_dispatch(self):
+        calls = []
+        handles = []
+
+        def first(message):
+            calls.append("first")
+            handles[1].remove()
+            self.protocol.add_op_callback(opcode.STATUS, lambda m: calls.append("late"))
+
+        handles.append(self.protocol.add_op_callback(opcode.STATUS, first))
+        handles.append(self.protocol.add_op_callback(opcode.STATUS, lambda m: calls.append("second")))
+        self.mocktransport.on_message("""STA {}""")
+        self.assertEqual(calls, ["first"], "Removed callbacks are skipped, new ones wait for the next frame.")
+
+        handles[0].remove()
+        self.mocktransport.on_message("""STA {}""")
+        self.assertEqual(calls, ["first", "late"])
+        self.assertEqual(len(self.protocol.callbacks[opcode.STATUS]), 1)
+
+    def test_failing_registration_is_removed(self):
+        calls = []
+
+        def flaky(message):
+            calls.append(1)
+            if len(calls) == 2:
+                raise ValueError("Second call fails.")
+
+        handles = [self.protocol.add_op_callback(opcode.STATUS, flaky) for _ in range(2)]
+        with self.assertLogs('flist.chat.protocol', 'ERROR'):
+            self.mocktransport.on_message("""STA {}""")
+        self.assertEqual([h.active for h in handles], [True, False], "The registration which raised is removed.")
+
+    def test_decodes_only_when_subscribed(self):
+        results = []
+        with patch.object(self.protocol, '_load_json', wraps=self.protocol._load_json) as load_json:
+            self.mocktransport.on_message("""STA {"status":"looking","character":"Adamoraco"}""")
+            self.assertFalse(load_json.called, "Frames without subscribers must not be decoded.")
+
+            self.protocol.add_message_handler(lambda op, message: results.append(op), opcodes=[opcode.STATUS])
+            self.mocktransport.on_message("""TPN {"status":"typing","character":"Adamoraco"}""")
+            self.assertFalse(load_json.called, "Handlers only decode the opcodes they asked for.")
+
+            self.protocol.add_op_callback(opcode.STATUS, results.append)
+            self.mocktransport.on_message("""STA {"status":"looking","character":"Adamoraco"}""")
+            self.assertEqual(load_json.call_count, 1, "A frame is decoded at most once.")
+        self.assertEqual(results[0]['status'], 'looking')
+        self.assertEqual(results[1], opcode.STATUS)
+
+    def test_message_handler_added_twice(self):
+        results = []
+
+        def handler(op, message):
+            results.append(op)
+
+        self.protocol.add_message_handler(handler)
+        self.protocol.add_message_handler(handler, opcodes=[opcode.STATUS])
+        self.protocol.remove_message_handler(handler)
+        self.mocktransport.on_message("""STA {"status":"looking","character":"Adamoraco"}""")
+        self.assertEqual(results, [opcode.STATUS], "Each registration is removed on its own.")
+        self.protocol.remove_message_handler(handler)
+        with self.assertRaises(ValueError):
+            self.protocol.remove_message_handler(handler)
+
     def test_pings(self):
         result = None
         def callback(message):
@@ -67,6 +150,32 @@ class TestFChatProtocol(unittest.TestCase):
         self.assertEqual(result, 'PIN', "The protocol responds to pings.")
 
 
+class TestWireTrace(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("test_wire_trace")
+        self.logger.setLevel(logging.INFO)
+        self.addCleanup(self.logger.setLevel, logging.NOTSET)
+
+    def test_per_opcode_levels(self):
+        self.logger.getChild(opcode.STATUS).setLevel(logging.WARNING)
+        self.addCleanup(self.logger.getChild(opcode.STATUS).setLevel, logging.NOTSET)
+        trace = WireTrace(self.logger)
+        with self.assertLogs(self.logger, logging.INFO) as logs:
+            trace("<--", opcode.STATUS, "STA {}")
+            trace("<--", opcode.CHANNEL_MESSAGE, "MSG {}")
+        self.assertEqual(logs.output, ["INFO:test_wire_trace.MSG:<-- MSG {}"])
+        self.assertIsNone(trace._loggers[opcode.STATUS], "Disabled opcodes are cached.")
+
+    def test_sampling_and_truncation(self):
+        trace = WireTrace(self.logger, max_length=10, sampling={opcode.TYPING: 3})
+        with self.assertLogs(self.logger, logging.INFO) as logs:
+            for _ in range(6):
+                trace("<--", opcode.TYPING, "TPN {}")
+            trace("<--", opcode.LIST_CHARACTERS, "LIS " + "x" * 100)
+        self.assertEqual(len(logs.output), 3)
+        self.assertTrue(logs.output[-1].endswith("LIS xxxxxx... (104 characters)"))
+
+
 class TestFChatPinger(unittest.TestCase):
     class MockFChatPinger(FChatPinger):
         def connect(self):
@@ -93,6 +202,30 @@ class TestFChatPinger(unittest.TestCase):
                     function()
                 on_close.assert_called_with(*TransportErrors.connection_exception)
 
+    def test_frames_do_not_reschedule(self):
+        scheduled = self.mocked_loop.call_later.call_count
+        for _ in range(10):
+            self.mocktransport.on_frame("STA {}")
+        self.assertEqual(self.mocked_loop.call_later.call_count, scheduled, "Frames only record activity.")
+
+    def test_no_ping_after_recent_send(self):
+        (seconds, function), kwargs = self.mocked_loop.call_later.call_args
+        with patch.object(WebsocketsClientAdapter, 'send_message') as send_message:
+            self.mocktransport.send_message("MSG {}")
+            send_message.reset_mock()
+            function()
+            self.assertFalse(send_message.called, "Recent traffic makes a ping unnecessary.")
+            (seconds, function), kwargs = self.mocked_loop.call_later.call_args
+            function()
+            send_message.assert_called_with(opcode.PING)
+
+    def test_dead_server_closes(self):
+        (seconds, function), kwargs = self.mocked_loop.call_later.call_args
+        self.mocked_loop.time.return_value = 121.0
+        with patch.object(self.mocktransport, 'on_close') as on_close:
+            function()
+            on_close.assert_called_with(*TransportErrors.connection_timeout)
+
 
 class TestFChat(unittest.TestCase):
     identification_procedure = [
@@ -117,6 +250,13 @@ class TestFChat(unittest.TestCase):
         self.protocol = FChatProtocol(self.mocktransport)
         self.chat = Connection(self.protocol, character)
 
+    def sending(self):
+        """Frames written from here on, as on an open connection."""
+        sent = []
+        self.mocktransport.send_message = sent.append
+        self.protocol.outbound.resume()
+        return sent
+
     def test_connect(self):
         def receiver(message):
             self.assertEqual(message[:3], "IDN", "First message should be chat identification.")
@@ -127,3 +267,433 @@ class TestFChat(unittest.TestCase):
 
         future = self.chat.connect()
         self.assertIsInstance(future.result(), Connection, "Future contains connection on successful identification.")
+
+    def test_frames_are_held_until_open_and_fail_once_closed(self):
+        written = []
+        early = self.protocol.message(opcode.STATUS, {'status': "busy"})
+        self.mocktransport.send_message = lambda message: written.append(message) or (
+            message.startswith("IDN") and self.mocktransport.on_message(self.identification_procedure[-1]))
+        self.chat.connect()
+        self.assertEqual([frame[:3] for frame in written], ["IDN", "STA"], "Held frames follow the identification.")
+        self.assertTrue(early.done())
+
+        self.mocktransport.on_close(*TransportErrors.connection_closed)
+        late = self.protocol.message(opcode.STATUS, {'status': "online"})
+        self.assertIsInstance(late.exception(), ConnectionResetError, "Without reconnecting the queue is closed.")
+        self.assertEqual(len(written), 2)
+
+    def test_channel_routing(self):
+        self.protocol.on_message(
+            """CHA {"channels":[{"name":"Dragons","mode":"both","characters":0},"""
+            """{"name":"Frontpage","mode":"both","characters":0}]}""")
+        received = []
+        dragons = self.chat.public_channels['Dragons']
+        self.chat.public_channels['Frontpage'].add_listener(
+            lambda channel, **message: received.append((channel.name, message)))
+
+        self.protocol.on_message("""MSG {"message":"Hi","character":"Hexxy","channel":"Dragons"}""")
+        self.assertEqual(received, [], "Messages for other channels are not delivered.")
+        self.protocol.on_message("""MSG {"message":"Evenin'","character":"Hexxy","channel":"Frontpage"}""")
+        self.assertEqual(received, [('Frontpage', {'message': "Evenin'", 'character': 'Hexxy'})])
+
+        self.protocol.on_message("""CDS {"description":"Topic","channel":"Dragons"}""")
+        self.assertEqual(dragons.description, "Topic")
+        self.assertEqual(self.chat.public_channels['Frontpage'].description, "")
+        self.assertEqual(len(self.protocol.callbacks[opcode.CHANNEL_MESSAGE]), 1,
+                         "A single protocol callback serves all channels.")
+
+    def test_failing_channel_listener_keeps_other_channels(self):
+        self.protocol.on_message(
+            """CHA {"channels":[{"name":"Dragons","mode":"both","characters":0},"""
+            """{"name":"Frontpage","mode":"both","characters":0}]}""")
+        received = []
+
+        def broken(channel, **message):
+            raise asyncio.QueueFull()
+
+        self.chat.public_channels['Dragons'].add_listener(broken)
+        self.chat.public_channels['Frontpage'].add_listener(lambda channel, **message: received.append(channel.name))
+        with self.assertLogs('flist.fchat', logging.ERROR):
+            self.protocol.on_message("""MSG {"message":"Hi","character":"Hexxy","channel":"Dragons"}""")
+        self.protocol.on_message("""MSG {"message":"Hi","character":"Hexxy","channel":"Frontpage"}""")
+        self.assertEqual(received, ["Frontpage"], "Other channels keep receiving messages.")
+        self.assertEqual(len(self.protocol.callbacks[opcode.CHANNEL_MESSAGE]), 1)
+
+    def test_async_channel_listeners_keep_order(self):
+        self.protocol.on_message("""CHA {"channels":[{"name":"Dragons","mode":"both","characters":0}]}""")
+        received = []
+
+        async def listener(channel, message, character):
+            await asyncio.sleep(0.02 if message == "first" else 0)
+            received.append(message)
+
+        self.chat.public_channels['Dragons'].add_listener(listener)
+        for text in ("first", "second"):
+            self.protocol.on_message("""MSG {"message":"%s","character":"Hexxy","channel":"Dragons"}""" % text)
+        self.protocol.loop.run_until_complete(self.protocol.execution.drain())
+        self.assertEqual(received, ["first", "second"], "Listeners of one channel finish in arrival order.")
+
+    def test_channel_listings_are_lazy(self):
+        self.protocol.on_message(
+            """ORS {"channels":[{"name":"ADH-1","title":"Quiet","characters":3},"""
+            """{"name":"ADH-2","title":"Loud","characters":40}]}""")
+        channels = self.chat.private_channels
+        self.assertEqual(len(channels), 2)
+        self.assertIn("ADH-1", channels)
+        self.assertEqual(channels.listing("ADH-2").title, "Loud")
+        self.assertFalse(channels.is_materialized("ADH-1"), "Listing a channel does not build it.")
+        self.assertNotIn(opcode.CHANNEL_MESSAGE, self.protocol.callbacks)
+
+        channel = channels["ADH-1"]
+        self.assertEqual(channel.title, "Quiet")
+        self.assertIs(channels["ADH-1"], channel, "A channel is built once.")
+
+        self.protocol.on_message("""ORS {"channels":[{"name":"ADH-3","title":"New","characters":1}]}""")
+        self.assertIs(channels["ADH-1"], channel, "Refreshing keeps built channels.")
+        self.assertEqual(sorted(channels), ["ADH-1", "ADH-3"])
+
+    def test_shared_characters(self):
+        self.protocol.on_message("""NLN {"status":"looking","gender":"Male","identity":"Hexxy"}""")
+        hexxy = self.chat.get_character("Hexxy")
+        self.assertIs(self.chat.get_character("Hexxy"), hexxy, "One Character is shared per name.")
+        self.assertFalse(hasattr(hexxy, '__dict__'))
+        self.assertEqual((hexxy.online, hexxy.status, hexxy.gender), (True, "looking", "Male"))
+        self.protocol.on_message("""FLN {"character":"Hexxy"}""")
+        self.assertEqual((hexxy.online, hexxy.status), (False, "offline"))
+
+    def test_watch_count_unsubscribes(self):
+        provider = self.chat.watch(opcode.TYPING, count=2, maxsize=10)
+        for status in ("typing", "paused", "clear"):
+            self.protocol.on_message("""TPN {"character":"Hexxy","status":"%s"}""" % status)
+        self.assertEqual([m['status'] for m in provider.buffer], ["typing", "paused"])
+        self.assertNotIn(opcode.TYPING, [op for op, callbacks in self.protocol.callbacks.items() if callbacks])
+
+    def test_blocked_watch_is_bounded(self):
+        transport = QueuedMockTransport(hold_timeout=0.05)
+        protocol = FChatProtocol(transport)
+        chat = Connection(protocol, MockAccount().characters['Adamoraco'])
+        protocol.connect()
+        typing = chat.watch(opcode.TYPING, maxsize=1, overflow=BLOCK)
+        handled = []
+        protocol.add_op_callback(opcode.PRIVATE_MESSAGE, lambda message: handled.append(message['message']))
+        protocol.add_op_callback(opcode.SYSTEM_MESSAGE, lambda message: handled.append(message['message']))
+
+        for _ in range(300):
+            transport.inbound.put("""TPN {"character":"Hexxy","status":"typing"}""")
+        transport.inbound.put("""PRI {"character":"Hexxy","message":"Hi"}""")
+        transport.inbound.put("""SYS {"message":"Notice"}""")
+        protocol.loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertEqual(handled, ["Notice"], "A blocked watcher holds back bulk frames, not control frames.")
+        self.assertEqual((len(typing), typing.blocked, len(protocol.execution.held)), (1, 1, 1))
+
+        with self.assertLogs('flist.chat.inbound', 'WARNING'):
+            protocol.loop.run_until_complete(asyncio.sleep(0.1))
+        self.assertEqual(handled, ["Notice", "Hi"], "The hold gives up after hold_timeout.")
+        self.assertEqual(transport.inbound.expired, 1)
+        self.assertEqual((typing.blocked, typing.dropped), (2, 298),
+                         "The expired item and the items beyond maxsize waiting are dropped.")
+        protocol.loop.run_until_complete(typing.__anext__())
+        protocol.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual((len(typing), len(protocol.execution.held)), (1, 0), "The waiting item moves in.")
+        typing.close()
+        transport.inbound.clear()
+
+    def test_watch_filters(self):
+        channels = self.chat.watch(opcode.CHANNEL_MESSAGE, match={'channel': {"Frontpage", "Dragons"}})
+        commands = self.chat.watch(opcode.CHANNEL_MESSAGE, match={'channel': "Dragons"}, prefix={'message': "!"})
+        frames = [("Frontpage", "Hi"), ("Elsewhere", "!roll 1d6"), ("Dragons", "!roll 2d6"), ("Dragons", "Hi")]
+        copies = []
+        enrich = ItemEnricher.__call__
+        with patch.object(ItemEnricher, '__call__', lambda *args: copies.append(1) or enrich(*args)):
+            for channel, message in frames:
+                self.protocol.on_message("""MSG {"character":"Hexxy","channel":"%s","message":"%s"}""" % (
+                    channel, message))
+        self.assertEqual([m['message'] for m in channels.buffer], ["Hi", "!roll 2d6", "Hi"])
+        self.assertEqual([m['message'] for m in commands.buffer], ["!roll 2d6"])
+        self.assertEqual(len(copies), 4, "Only accepted messages are copied.")
+        self.assertEqual(len(self.protocol.callbacks[opcode.CHANNEL_MESSAGE]), 1, "Watchers share one callback.")
+
+    def test_join_correlates_own_join(self):
+        sent = self.sending()
+        first = self.chat.join("Frontpage")
+        second = self.chat.join("Frontpage")
+        self.chat.join("Dragons")
+        self.assertEqual(decoded(sent), [("JCH", {'channel': "Frontpage"}), ("JCH", {'channel': "Dragons"})],
+                         "Requests already in flight are not repeated.")
+
+        self.protocol.on_message("""JCH {"character":{"identity":"Hexxy"},"channel":"Frontpage","title":"Frontpage"}""")
+        self.assertFalse(first.done(), "Other characters joining do not answer our request.")
+        self.protocol.on_message(
+            """JCH {"character":{"identity":"Adamoraco"},"channel":"Frontpage","title":"Frontpage"}""")
+        self.protocol.loop.run_until_complete(asyncio.gather(first, second))
+        self.assertIs(first.result(), second.result())
+        self.assertEqual(first.result().name, "Frontpage")
+        self.assertEqual(list(self.chat.requests.pending), [(opcode.JOIN_CHANNEL, "Dragons")])
+
+        channel = first.result()
+        operators = channel.list_operators()
+        self.protocol.on_message("""COL {"channel":"Frontpage","oplist":["Hexxy"]}""")
+        self.assertEqual(self.protocol.loop.run_until_complete(operators), ["Hexxy"])
+
+    def test_join_errors(self):
+        self.sending()
+        denied = self.chat.join("Secret")
+        unknown = self.chat.join("Nowhere")
+        self.protocol.on_message('ERR {"number":5,"message":"You must wait one second between messages."}')
+        self.assertEqual(len(self.chat.requests.pending), 2, "Errors of other commands are left alone.")
+        self.protocol.on_message('ERR {"number":44,"message":"You may only join this channel with an invite."}')
+        self.protocol.on_message('ERR {"number":26,"message":"Could not locate the requested channel."}')
+        for future, number in ((denied, 44), (unknown, 26)):
+            with self.assertRaises(ServerError) as raised:
+                self.protocol.loop.run_until_complete(future)
+            self.assertEqual(raised.exception.number, number, "Errors answer the joins in order.")
+
+        operators = Channel(self.chat, "Nowhere").list_operators()
+        self.protocol.on_message('ERR {"number":26,"message":"Could not locate the requested channel."}')
+        with self.assertRaises(ServerError):
+            self.protocol.loop.run_until_complete(operators)
+
+    def test_join_listed_channel(self):
+        sent = self.sending()
+        self.protocol.on_message("""CHA {"channels":[{"name":"Frontpage","mode":"both","characters":0}]}""")
+        self.assertEqual(self.chat.public_channels['Frontpage'].name, "Frontpage")
+        joined = self.chat.join("Frontpage")
+        self.assertFalse(joined.done(), "Being listed does not mean we are in the channel.")
+        self.assertEqual(decoded(sent), [("JCH", {'channel': "Frontpage"})])
+
+        self.protocol.on_message(
+            """JCH {"character":{"identity":"Adamoraco"},"channel":"Frontpage","title":"Frontpage"}""")
+        channel = self.protocol.loop.run_until_complete(joined)
+        self.assertIs(channel, self.chat.public_channels['Frontpage'])
+        self.assertIs(self.chat.join("Frontpage").result(), channel, "Channels we are in resolve at once.")
+        self.assertEqual(len(sent), 1)
+
+    def test_request_timeout_and_cancel(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self.protocol.loop = loop
+        self.mocktransport.send_message = lambda message: None
+        request = self.chat.requests.request(opcode.LIST_OPS, "Dragons", timeout=0.01)
+        with self.assertRaises(asyncio.TimeoutError):
+            loop.run_until_complete(request)
+        cancelled = self.chat.requests.request(opcode.LIST_OPS, "Dragons")
+        cancelled.cancel()
+        loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(self.chat.requests.pending, {}, "Finished requests are cleaned up.")
+
+    def test_profile_errors_and_stale_streams(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self.protocol.loop = loop
+        self.chat.profiles.timeout = 0.01
+        sent = self.sending()
+        unknown = asyncio.ensure_future(self.chat.get_character("Nobody").profile(), loop=loop)
+        slow = asyncio.ensure_future(self.chat.get_character("Kira").profile(), loop=loop)
+        hexxy = asyncio.ensure_future(self.chat.get_character("Hexxy").profile(), loop=loop)
+        loop.run_until_complete(asyncio.sleep(0))
+        self.protocol.on_message('ERR {"number":5,"message":"You must wait one second between messages."}')
+        self.assertEqual(self.chat.profiles.current[0], "Nobody", "Errors of other commands are left alone.")
+        self.protocol.on_message('ERR {"number":6,"message":"This character does not exist."}')
+        with self.assertRaises(ServerError):
+            loop.run_until_complete(unknown)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            loop.run_until_complete(slow)
+        for frame in ['PRD {"type":"start","message":"Profile of Kira"}',
+                      'PRD {"type":"info","key":"Age","value":"30"}',
+                      'PRD {"type":"end"}',
+                      'PRD {"type":"start","message":"Profile of Hexxy"}',
+                      'PRD {"type":"info","key":"Age","value":"25"}',
+                      'PRD {"type":"end"}']:
+            self.protocol.on_message(frame)
+        self.assertEqual(loop.run_until_complete(hexxy).fields, {"Age": "25"},
+                         "The late stream of a timed out request is not assigned to the next one.")
+        self.assertEqual([json.loads(m[4:])['character'] for m in sent], ["Nobody", "Kira", "Hexxy"])
+
+    def test_profiles_are_assembled_coalesced_and_cached(self):
+        loop = self.protocol.loop
+        sent = self.sending()
+        hexxy = self.chat.get_character("Hexxy")
+        requests = asyncio.gather(hexxy.profile(), hexxy.profile(), self.chat.get_character("Kira").profile())
+        loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(decoded(sent), [("PRO", {'character': "Hexxy"})], "One request at a time, shared by both callers.")
+
+        for frame in ['PRD {"type":"start","message":"Profile of Hexxy"}',
+                      'PRD {"type":"info","key":"Age","value":"25"}',
+                      'PRD {"type":"select","key":"Gender","value":"Male"}',
+                      'PRD {"type":"end"}',
+                      'PRD {"type":"start","message":"Profile of Kira"}',
+                      'PRD {"type":"end"}']:
+            self.protocol.on_message(frame)
+            loop.run_until_complete(asyncio.sleep(0))
+        first, second, kira = loop.run_until_complete(requests)
+        self.assertEqual(decoded(sent[1:]), [("PRO", {'character': "Kira"})])
+        self.assertEqual(first, ("Hexxy", {"Age": "25", "Gender": "Male"}))
+        self.assertIs(first, second)
+        self.assertEqual(kira.fields, {})
+
+        self.assertIs(loop.run_until_complete(hexxy.profile()), first, "Profiles are cached.")
+        self.assertEqual(len(sent), 2)
+
+
+class StandInServer(object):
+    """Local websocket server answering identification, joins and nothing else."""
+
+    def __init__(self):
+        self.sockets = []
+        self.received = []
+
+    async def start(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get('/', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        return "ws://%s:%d/" % (host, port)
+
+    async def handle(self, request):
+        from aiohttp import web
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        self.sockets.append(websocket)
+        identity = None
+        async for message in websocket:
+            self.received.append(message.data)
+            op, data = message.data[:3], json.loads(message.data[4:] or "{}")
+            if op == opcode.IDENTIFY:
+                identity = data['character']
+                await websocket.send_str("NLN " + json.dumps({'identity': data['character'], 'gender': "Male",
+                                                              'status': "online"}))
+            elif op == opcode.JOIN_CHANNEL:
+                await websocket.send_str("JCH " + json.dumps({'channel': data['channel'], 'title': data['channel'],
+                                                              'character': {'identity': identity}}))
+        return websocket
+
+
+class TestReconnect(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    async def wait_for(self, condition, timeout=5):
+        deadline = self.loop.time() + timeout
+        while not condition():
+            self.assertLess(self.loop.time(), deadline, "Timed out.")
+            await asyncio.sleep(0.01)
+
+    def test_recovery(self):
+        self.loop.run_until_complete(self.recovery())
+
+    async def recovery(self):
+        server = StandInServer()
+        url = await server.start()
+        transport = DefaultFChatTransport(url, loop=self.loop)
+        chat = Connection(FChatProtocol(transport, loop=self.loop), MockAccount().characters['Adamoraco'])
+        try:
+            await chat.connect(reconnect=Backoff(initial=0.01, jitter=0))
+            dragons = await chat.join("Dragons")
+            received = []
+            dragons.add_listener(lambda channel, **message: received.append(message['message']))
+            messages = chat.watch(opcode.PRIVATE_MESSAGE, count=1)
+
+            await server.sockets[0].close()
+            await self.wait_for(lambda: chat.reconnects == 1)
+            self.assertLess(chat.recovery_time, 1.0, "Recovery takes a backoff delay and a couple of round trips.")
+            identifications = [frame for frame in server.received if frame.startswith(opcode.IDENTIFY)]
+            self.assertEqual(len(identifications), 2)
+            self.assertEqual([data['ticket'] for op, data in decoded(identifications)], ["MockTicket"] * 2,
+                             "The ticket is reused.")
+            self.assertTrue(chat.memberships.is_member("Dragons", "Adamoraco"), "Channels are joined again.")
+
+            await server.sockets[1].send_str('MSG {"channel":"Dragons","character":"Hexxy","message":"Welcome back"}')
+            await server.sockets[1].send_str('PRI {"character":"Hexxy","message":"Hi"}')
+            await self.wait_for(lambda: received)
+            self.assertEqual(received, ["Welcome back"], "Channel listeners survive the reconnect.")
+            async for message in messages:
+                self.assertEqual(message['message'], "Hi", "Watches survive the reconnect.")
+        finally:
+            chat.quit()
+            await transport.session.close()
+            await server.runner.cleanup()
+
+
+    def test_close_stops_a_pending_connect(self):
+        self.loop.run_until_complete(self.close_stops_a_pending_connect())
+
+    async def close_stops_a_pending_connect(self):
+        server = StandInServer()
+        url = await server.start()
+        connecting = asyncio.Event()
+
+        class SlowSession(object):
+            @staticmethod
+            def ws_connect(url):
+                return SlowConnect()
+
+        class SlowConnect(object):
+            async def __aenter__(self):
+                await connecting.wait()
+                return await transport_session.ws_connect(url).__aenter__()
+
+            async def __aexit__(self, *exc_info):
+                pass
+
+        transport_session = aiohttp.ClientSession()
+        transport = DefaultFChatTransport(url, loop=self.loop, session=SlowSession())
+        opened = []
+        transport.fchat_on_open = lambda: opened.append(1)
+        try:
+            transport.connect()
+            reader = transport.reader
+            await asyncio.sleep(0.01)
+            transport.close()
+            connecting.set()
+            await asyncio.sleep(0.05)
+            self.assertTrue(reader.cancelled(), "Closing cancels the attempt still connecting.")
+            self.assertEqual((opened, server.sockets), ([], []), "A cancelled attempt never opens.")
+        finally:
+            await transport_session.close()
+            await server.runner.cleanup()
+
+
+class TestConnectionManager(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_shared_resources_and_streams(self):
+        self.loop.run_until_complete(self.shared_resources_and_streams())
+
+    async def shared_resources_and_streams(self):
+        server = StandInServer()
+        manager = ConnectionManager(await server.start(), loop=self.loop, connect_interval=0.01)
+        account = MockAccount()
+        account.characters['Hexxy'] = Character('Hexxy', account)
+        try:
+            connections = [await manager.start(character) for character in account.characters.values()]
+            transports = [connection.protocol.transport for connection in connections]
+            self.assertIs(transports[0].session, transports[1].session, "One HTTP session serves every connection.")
+            self.assertEqual(manager.keepalive.pingers, set(transports), "One timer keeps every connection alive.")
+            self.assertNotIn(opcode.STATUS, transports[0].inbound.shed_opcodes, "The roster needs every STA.")
+
+            messages = manager.watch(opcode.PRIVATE_MESSAGE)
+            for websocket, sender in zip(server.sockets, ["Kira", "Moar"]):
+                await websocket.send_str('PRI {"character":"%s","message":"Hi"}' % sender)
+            received = [await messages.__anext__() for _ in range(2)]
+            self.assertEqual(sorted((str(c.character), m['character']) for c, m in received),
+                             [("Adamoraco", "Kira"), ("Hexxy", "Moar")])
+
+            stats = manager.stats()
+            self.assertEqual(stats['Hexxy'].received, 2, "NLN and PRI.")
+            self.assertEqual(stats['Hexxy'].sent, 1, "IDN.")
+
+            manager.remove('Hexxy')
+            self.assertEqual(list(manager.stats()), ["Adamoraco"])
+            self.assertEqual(manager.keepalive.pingers, {transports[0]})
+        finally:
+            await manager.close()
+            await server.runner.cleanup()
+        self.assertTrue(messages.closed)
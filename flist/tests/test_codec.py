@@ -0,0 +1,29 @@
+import unittest
+
+from flist.codec import available_codecs, get_codec, JSONCodec
+
+
+class TestCodecs(unittest.TestCase):
+    frame = '{"message":"Evenin\' \\u2603","character":"Hexxy","channel":"Frontpage","count":3}'
+
+    def test_codecs_agree(self):
+        expected = JSONCodec.loads(self.frame)
+        for codec in available_codecs():
+            self.assertEqual(codec.loads(self.frame), expected, codec.name)
+            self.assertEqual(codec.loads(codec.dumps(expected)), expected, codec.name)
+            self.assertIsInstance(codec.dumps(expected), str, "Codecs produce text frames.")
+
+    def test_same_wire_format(self):
+        obj = {'channel': "Frontpage", 'message': "Evenin' \u2603"}
+        self.assertEqual({codec.dumps(obj) for codec in available_codecs()},
+                         {'{"channel":"Frontpage","message":"Evenin\' \u2603"}'},
+                         "Frames do not depend on the installed backend.")
+
+    def test_decode_errors_are_value_errors(self):
+        for codec in available_codecs():
+            with self.assertRaises(ValueError):
+                codec.loads('{["Teal Deer","Male","busy"]}')
+
+    def test_stdlib_fallback(self):
+        self.assertEqual(get_codec("json").name, "json")
+        self.assertEqual(available_codecs()[-1].name, "json")
@@ -0,0 +1,92 @@
+import unittest
+import asyncio
+
+from flist.chat import opcode
+from flist.chat.execution import ExecutionPolicy
+
+
+class TestExecutionPolicy(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.events = []
+        self.active = 0
+        self.peak = 0
+
+    async def handler(self, name, delay=0.01):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        self.events.append(("start", name))
+        await asyncio.sleep(delay)
+        self.events.append(("end", name))
+        self.active -= 1
+
+    def test_channel_order(self):
+        policy = ExecutionPolicy(self.loop)
+        for i, channel in enumerate(["A", "B", "A", "B", "A"]):
+            policy.submit(opcode.CHANNEL_MESSAGE, {'channel': channel}, self.handler("%s%d" % (channel, i), 0.01 * (5 - i)))
+        self.loop.run_until_complete(policy.drain())
+
+        for channel in "AB":
+            started = [name for event, name in self.events if event == "start" and name[0] == channel]
+            ended = [name for event, name in self.events if event == "end" and name[0] == channel]
+            self.assertEqual(started, sorted(started), "Each channel runs in arrival order.")
+            self.assertEqual(started, ended, "One handler per channel runs at a time.")
+        self.assertEqual(self.peak, 2, "Different channels run concurrently.")
+        self.assertEqual(policy.completed, 5)
+        self.assertFalse(policy.lanes)
+
+    def test_limits(self):
+        policy = ExecutionPolicy(self.loop, limit=3, op_limits={opcode.STATUS: 1}, lane_keys={})
+        for i in range(4):
+            policy.submit(opcode.STATUS, {}, self.handler("STA%d" % i))
+        self.assertEqual((policy.running, policy.queued), (1, 3))
+        for i in range(4):
+            policy.submit(opcode.PRIVATE_MESSAGE, {}, self.handler("PRI%d" % i))
+        self.assertEqual((policy.running, policy.queued), (3, 5))
+        self.loop.run_until_complete(policy.drain())
+        self.assertEqual(self.peak, 3)
+        self.assertEqual(policy.completed, 8)
+
+    def test_failure_and_cancel(self):
+        policy = ExecutionPolicy(self.loop, limit=1)
+
+        async def fail():
+            raise RuntimeError("Broken handler")
+
+        with self.assertLogs('flist.chat.execution', 'ERROR'):
+            policy.submit(opcode.PRIVATE_MESSAGE, {'character': "Hexxy"}, fail())
+            self.loop.run_until_complete(policy.drain())
+        self.assertEqual(policy.failed, 1)
+
+        policy.submit(opcode.PRIVATE_MESSAGE, {'character': "Hexxy"}, self.handler("first", 10))
+        policy.submit(opcode.PRIVATE_MESSAGE, {'character': "Hexxy"}, self.handler("second"))
+        self.loop.run_until_complete(asyncio.sleep(0))
+        policy.cancel()
+        self.loop.run_until_complete(policy.drain())
+        self.assertEqual(self.events, [("start", "first")])
+        self.assertEqual((policy.running, policy.queued), (0, 0))
+
+    def test_held_futures_do_not_take_slots(self):
+        held = []
+        policy = ExecutionPolicy(self.loop, limit=1, on_hold=held.append)
+        blocked = self.loop.create_future()
+        policy.submit(opcode.TYPING, {}, blocked)
+        policy.submit(opcode.PRIVATE_MESSAGE, {'character': "Hexxy"}, self.handler("PRI"))
+        self.loop.run_until_complete(policy.drain())
+        self.assertEqual(self.events, [("start", "PRI"), ("end", "PRI")],
+                         "A watcher waiting for its consumer does not stop other handlers.")
+        self.assertEqual((held, policy.held), ([blocked], {blocked}))
+
+        policy.cancel()
+        self.assertTrue(blocked.cancelled())
+
+    def test_concurrent_drains(self):
+        policy = ExecutionPolicy(self.loop)
+        policy.submit(opcode.PRIVATE_MESSAGE, {'character': "Hexxy"}, self.handler("PRI"))
+
+        async def drains():
+            await asyncio.wait_for(asyncio.gather(policy.drain(), policy.drain()), 1)
+
+        self.loop.run_until_complete(drains())
+        self.assertEqual(policy.completed, 1, "Every drain returns once the work is done.")
@@ -0,0 +1,85 @@
+import unittest
+import asyncio
+
+from flist.chat.inbound import InboundQueue, PRIORITY, BULK
+
+
+class TestInboundQueue(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.dispatched = []
+        self.queue = InboundQueue(self.dispatched.append, self.loop, maxsize=6, shed_depth=3, batch=2)
+
+    def run_dispatch(self):
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def test_priority_first(self):
+        for i in range(4):
+            self.queue.put("MSG %d" % i)
+        self.queue.put("PIN")
+        self.queue.put("ERR {}")
+        self.assertEqual(self.dispatched, [], "The reader only queues frames.")
+        self.assertEqual((self.queue.depth(PRIORITY), self.queue.depth(BULK)), (2, 4))
+
+        self.run_dispatch()
+        self.assertEqual(self.dispatched[:2], ["PIN", "ERR {}"], "Control frames skip the waiting bulk frames.")
+        self.assertEqual(self.dispatched[2:], ["MSG 0", "MSG 1", "MSG 2", "MSG 3"])
+        self.assertEqual(self.queue.dispatched, 6)
+
+    def test_shedding_and_backpressure(self):
+        for i in range(3):
+            self.queue.put("MSG %d" % i)
+        self.queue.put("TPN {}")
+        self.queue.put("STA {}")
+        self.assertEqual(self.queue.shed, 2, "Typing and status frames are shed once the bulk lane backs up.")
+        for i in range(3, 6):
+            self.queue.put("MSG %d" % i)
+        self.assertTrue(self.queue.full)
+        self.assertEqual(self.queue.high_water, 6)
+
+        self.loop.run_until_complete(self.queue.wait_for_space())
+        self.assertFalse(self.queue.full)
+        self.run_dispatch()
+        self.assertEqual(self.dispatched, ["MSG %d" % i for i in range(6)], "Other frames are never shed.")
+
+    def test_status_kept_for_rosters(self):
+        queue = InboundQueue(self.dispatched.append, self.loop, shed_depth=0, shed={"TPN"})
+        queue.put("TPN {}")
+        queue.put("STA {}")
+        self.run_dispatch()
+        self.assertEqual((self.dispatched, queue.shed), (["STA {}"], 1))
+
+    def test_failing_dispatch(self):
+        def dispatch(frame):
+            raise ValueError(frame)
+
+        queue = InboundQueue(dispatch, self.loop)
+        queue.put("MSG {}")
+        queue.put("PIN")
+        with self.assertLogs('flist.chat.inbound', 'ERROR') as logs:
+            self.run_dispatch()
+        self.assertEqual(len(logs.output), 2, "A failing frame does not stop the dispatch.")
+
+    def test_hold_pauses_bulk_lane(self):
+        blocked = self.loop.create_future()
+        self.queue.hold(blocked)
+        self.queue.put("MSG 0")
+        self.queue.put("PIN")
+        self.run_dispatch()
+        self.assertEqual(self.dispatched, ["PIN"], "Only control frames pass while a consumer is blocked.")
+
+        blocked.set_result(None)
+        self.run_dispatch()
+        self.assertEqual(self.dispatched, ["PIN", "MSG 0"])
+        self.assertEqual(self.queue.holds, {})
+
+    def test_hold_expires(self):
+        queue = InboundQueue(self.dispatched.append, self.loop, hold_timeout=0.01)
+        blocked = self.loop.create_future()
+        queue.hold(blocked)
+        queue.put("MSG 0")
+        with self.assertLogs('flist.chat.inbound', 'WARNING'):
+            self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertTrue(blocked.cancelled(), "A consumer which stays blocked loses its item.")
+        self.assertEqual((self.dispatched, queue.expired, queue.holds), (["MSG 0"], 1, {}))
@@ -0,0 +1,74 @@
+import unittest
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from flist.chat import opcode
+from flist.chat.offload import offload
+from flist.chat.protocol import FChatProtocol
+from flist.chat.transport import FChatTransport
+
+
+def word_count(text):
+    return len(text.split())
+
+
+class TestOffloadedCallback(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.executor = ThreadPoolExecutor(4)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_limit_and_queue_depth(self):
+        release = threading.Event()
+        threads = set()
+
+        def work(message):
+            threads.add(threading.get_ident())
+            release.wait(5)
+            return message['message'].upper()
+
+        delivered = []
+        callback = offload(work, self.executor, limit=2, maxsize=1,
+                           deliver=lambda message, result: delivered.append(result))
+        calls = [callback({'message': text}) for text in ("a", "b", "c", "d")]
+        self.assertIsNone(calls[3], "Calls beyond the queue are dropped before a task is created.")
+        self.assertEqual((callback.running, callback.queued, callback.high_water), (2, 1, 1))
+        tasks = [asyncio.ensure_future(call, loop=self.loop) for call in calls[:3]]
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertEqual((callback.running, callback.queued), (2, 1))
+
+        release.set()
+        self.loop.run_until_complete(asyncio.gather(*tasks))
+        self.assertEqual(sorted(delivered), ["A", "B", "C"])
+        self.assertNotIn(threading.get_ident(), threads, "The work runs off the event loop thread.")
+        self.assertEqual((callback.running, callback.completed, callback.dropped), (0, 3, 1))
+
+    def test_protocol_callback_caps_apply_within_a_channel(self):
+        release = threading.Event()
+        protocol = FChatProtocol(FChatTransport(), loop=self.loop)
+        callback = offload(lambda message: release.wait(5), self.executor, limit=2, maxsize=1)
+        protocol.add_op_callback(opcode.CHANNEL_MESSAGE, callback)
+        for i in range(6):
+            protocol.on_message('MSG {"channel":"Dragons","character":"Hexxy","message":"%d"}' % i)
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertEqual((callback.running, callback.queued, callback.dropped), (2, 1, 3))
+        self.assertEqual(protocol.execution.queued, 0, "Offloaded calls do not wait in the channel lane.")
+
+        release.set()
+        self.loop.run_until_complete(protocol.execution.drain())
+        self.assertEqual((callback.running, callback.completed, callback.high_water), (0, 3, 1))
+
+    def test_protocol_callback_in_process_pool(self):
+        executor = ProcessPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+        counts = []
+        protocol = FChatProtocol(FChatTransport(), loop=self.loop)
+        protocol.add_op_callback(opcode.PRIVATE_MESSAGE, offload(
+            word_count, executor, payload=lambda message: message['message'],
+            deliver=lambda message, result: counts.append((message['character'], result))))
+
+        protocol.on_message('PRI {"character":"Hexxy","message":"roll a d20 please"}')
+        self.loop.run_until_complete(protocol.execution.drain())
+        self.assertEqual(counts, [("Hexxy", 4)])
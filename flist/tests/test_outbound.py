@@ -0,0 +1,92 @@
+import unittest
+import asyncio
+import gc
+
+from flist.chat import opcode
+from flist.chat.outbound import OutboundQueue
+
+
+class TestOutboundQueue(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.written = []
+        self.queue = OutboundQueue(lambda op, frame: self.written.append(frame), self.loop, maxsize=2, margin=0)
+        self.queue.set_variable('msg_flood', 0.02)
+
+    def test_flood_limit_and_priority(self):
+        first = self.queue.put(opcode.CHANNEL_MESSAGE, "MSG 1")
+        self.assertEqual(self.written, ["MSG 1"], "Nothing queued, the frame is written at once.")
+        self.assertTrue(first.done())
+
+        second = self.queue.put(opcode.CHANNEL_MESSAGE, "MSG 2")
+        self.queue.put(opcode.JOIN_CHANNEL, "JCH")
+        self.queue.put(opcode.PING, "PIN")
+        self.assertEqual(self.written, ["MSG 1", "PIN"], "Priority frames bypass the flood limited lane.")
+        self.assertEqual(self.queue.depth(), 2)
+
+        self.loop.run_until_complete(second)
+        self.assertEqual(self.written, ["MSG 1", "PIN", "MSG 2", "JCH"], "The default lane keeps its order.")
+
+    def test_backpressure(self):
+        self.queue.put(opcode.CHANNEL_MESSAGE, "MSG 1")
+        self.queue.put(opcode.CHANNEL_MESSAGE, "MSG 2")
+        self.queue.put(opcode.CHANNEL_MESSAGE, "MSG 3")
+        with self.assertRaises(asyncio.QueueFull):
+            self.queue.put(opcode.CHANNEL_MESSAGE, "MSG 4")
+
+        async def send():
+            await self.queue.wait_for_space()
+            await self.queue.put(opcode.CHANNEL_MESSAGE, "MSG 4")
+
+        self.loop.run_until_complete(send())
+        self.assertEqual(self.written, ["MSG 1", "MSG 2", "MSG 3", "MSG 4"])
+
+    def test_close_cancels_queued(self):
+        self.queue.put(opcode.CHANNEL_MESSAGE, "MSG 1")
+        queued = self.queue.put(opcode.CHANNEL_MESSAGE, "MSG 2")
+        self.queue.close()
+        self.assertTrue(queued.cancelled())
+
+    def test_write_result_and_pause(self):
+        writes = []
+
+        def write(op, frame):
+            writes.append((frame, self.loop.create_future()))
+            return writes[-1][1]
+
+        queue = OutboundQueue(write, self.loop)
+        sent = queue.put(opcode.STATUS, "STA 1")
+        failed = queue.put(opcode.STATUS, "STA 2")
+        self.assertFalse(sent.done(), "Resolves once the transport finished writing.")
+        writes[0][1].set_result(None)
+        writes[1][1].set_exception(ConnectionResetError())
+        self.loop.run_until_complete(sent)
+        with self.assertRaises(ConnectionResetError, msg="Write errors reach the sender."):
+            self.loop.run_until_complete(failed)
+
+        queue.pause()
+        queue.put(opcode.STATUS, "STA 3")
+        queue.put(opcode.IDENTIFY, "IDN")
+        self.assertEqual(len(writes), 2, "Frames are held while the connection is down.")
+        queue.resume()
+        self.assertEqual([frame for frame, future in writes[2:]], ["IDN", "STA 3"])
+
+    def test_failures_are_final_and_retrieved(self):
+        reported = []
+        self.loop.set_exception_handler(lambda loop, context: reported.append(context))
+
+        def write(op, frame):
+            raise ConnectionResetError()
+
+        OutboundQueue(write, self.loop).put(opcode.STATUS, "STA 1")
+        gc.collect()
+        self.assertEqual(reported, [], "Failures of frames nobody awaits are not reported.")
+
+        queue = OutboundQueue(lambda op, frame: self.written.append(frame), self.loop, paused=True)
+        held = queue.put(opcode.STATUS, "STA 2")
+        queue.fail(ConnectionResetError("Closed"))
+        later = queue.put(opcode.STATUS, "STA 3")
+        self.assertIsInstance(held.exception(), ConnectionResetError)
+        self.assertIsInstance(later.exception(), ConnectionResetError, "Frames put after fail() are rejected.")
+        self.assertEqual(self.written, [])
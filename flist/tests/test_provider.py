@@ -1,6 +1,6 @@
 import unittest
 import asyncio
-from flist.aiter_provider import Provider
+from flist.aiter_provider import Provider, DROP_NEWEST, COALESCE, BLOCK
 
 
 class TestProvider(unittest.TestCase):
@@ -35,3 +35,49 @@ class TestProvider(unittest.TestCase):
         self.loop.run_until_complete(self.event_runner(self.provider, future))
         self.assertTrue(future.done())
         self.assertEqual([], future.result())
+
+    def collect(self, provider):
+        future = asyncio.Future()
+        self.loop.run_until_complete(self.event_runner(provider, future))
+        return future.result()
+
+    def test_bounded_drop_oldest(self):
+        provider = Provider(maxsize=2)
+        for i in range(1, 6):
+            provider.put_item(i)
+        provider.close()
+        self.assertEqual(self.collect(provider), [4, 5])
+        self.assertEqual((provider.dropped, provider.high_water), (3, 2))
+
+    def test_bounded_drop_newest(self):
+        provider = Provider(maxsize=2, overflow=DROP_NEWEST)
+        for i in range(1, 6):
+            provider.put_item(i)
+        provider.close()
+        self.assertEqual(self.collect(provider), [1, 2])
+        self.assertEqual(provider.dropped, 3)
+
+    def test_bounded_coalesce(self):
+        provider = Provider(maxsize=2, overflow=COALESCE, key=lambda item: item['character'])
+        for character, status in [("a", 1), ("b", 1), ("a", 2), ("c", 1)]:
+            provider.put_item({'character': character, 'status': status})
+        provider.close()
+        self.assertEqual([(i['character'], i['status']) for i in self.collect(provider)], [("b", 1), ("c", 1)])
+        self.assertEqual((provider.coalesced, provider.dropped), (1, 1))
+
+    def test_bounded_block(self):
+        provider = Provider(maxsize=1, overflow=BLOCK)
+        self.assertIsNone(provider.put_item(1))
+        blocked = provider.put_item(2)
+        self.assertFalse(blocked.done(), "The producer is told to wait.")
+        self.assertIsNone(provider.put_item(3), "At most maxsize items wait for room.")
+        self.assertEqual((provider.blocked, provider.dropped), (1, 1))
+        self.assertEqual(self.loop.run_until_complete(provider.__anext__()), 1)
+        self.assertTrue(blocked.done(), "Consuming makes room for the blocked item.")
+        provider.close()
+        self.assertEqual(self.collect(provider), [2])
+
+    def test_closed_provider_rejects_items(self):
+        self.provider.close()
+        with self.assertRaises(BrokenPipeError):
+            self.provider.put_item(1)
@@ -0,0 +1,89 @@
+import unittest
+import asyncio
+
+from flist.roster import Roster, RosterIngest, Memberships, ONLINE, OFFLINE, STATUS_CHANGED
+
+
+class TestRoster(unittest.TestCase):
+    def setUp(self):
+        self.roster = Roster()
+        self.events = []
+        self.roster.add_listener(lambda event, entry: self.events.append((event, entry.name)))
+        self.roster.on_list({'characters': [["Teal Deer", "Male", "busy", ""],
+                                            ["Natsudra", "Female", "looking", "Say hi"]]})
+
+    def test_indexes(self):
+        self.assertIn("Natsudra", self.roster)
+        self.assertEqual(self.roster.with_status("looking"), {"Natsudra"})
+        self.assertEqual(self.roster.with_gender("Male"), {"Teal Deer"})
+        self.assertEqual(self.roster.get("Natsudra").statusmsg, "Say hi")
+
+    def test_updates(self):
+        self.roster.on_connected({'identity': "Hexxy", 'gender': "Male", 'status': "online"})
+        self.roster.on_status({'character': "Teal Deer", 'status': "looking", 'statusmsg': "Free now"})
+        self.roster.on_offline({'character': "Natsudra"})
+        self.roster.on_status({'character': "Nobody", 'status': "busy", 'statusmsg': ""})
+
+        self.assertEqual(self.roster.with_status("looking"), {"Teal Deer"})
+        self.assertEqual(self.roster.with_status("busy"), frozenset())
+        self.assertEqual(self.roster.with_gender("Male"), {"Teal Deer", "Hexxy"})
+        self.assertNotIn("Natsudra", self.roster)
+        self.assertNotIn("busy", self.roster.by_status, "Empty index buckets are dropped.")
+        self.assertEqual(self.events[2:], [(ONLINE, "Hexxy"), (STATUS_CHANGED, "Teal Deer"), (OFFLINE, "Natsudra")])
+
+
+class TestRosterIngest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.roster = Roster()
+        self.ingest = RosterIngest(self.roster, self.loop, chunk_size=100)
+
+    def test_chunked_ingest_keeps_event_order(self):
+        characters = [["Character %d" % i, "Male", "online", ""] for i in range(250)]
+        self.ingest.on_list({'characters': characters})
+        self.ingest.on_status({'character': "Character 249", 'status': "looking", 'statusmsg': ""})
+        self.ingest.on_offline({'character': "Character 0"})
+        self.ingest.complete()
+        self.assertEqual(len(self.roster), 0, "Nothing is applied while the frame is being dispatched.")
+
+        sizes = []
+        self.loop.call_soon(lambda: sizes.append(len(self.roster)))
+        roster = self.loop.run_until_complete(self.ingest.ready)
+        self.assertEqual(sizes, [100], "The loop runs other work between chunks.")
+        self.assertIs(roster, self.roster)
+        self.assertEqual(len(roster), 249)
+        self.assertEqual(roster.with_status("looking"), {"Character 249"})
+
+    def test_events_apply_directly_when_idle(self):
+        self.ingest.on_connected({'identity': "Hexxy", 'gender': "Male", 'status': "online"})
+        self.assertIn("Hexxy", self.roster)
+        self.assertFalse(self.ingest.ready.done(), "Ready waits for the flood to be marked complete.")
+        self.ingest.complete()
+        self.assertTrue(self.ingest.ready.done())
+
+
+class TestMemberships(unittest.TestCase):
+    def setUp(self):
+        self.memberships = Memberships("Adamoraco")
+        for channel in ("Frontpage", "Dragons"):
+            self.memberships.on_join({'character': {'identity': "Adamoraco"}, 'channel': channel})
+            self.memberships.on_initial({'channel': channel, 'mode': "chat", 'users': [
+                {'identity': "Adamoraco"}, {'identity': "Hexxy"}, {'identity': channel + " regular"}]})
+
+    def test_reverse_index(self):
+        self.assertEqual(self.memberships.character_channels("Hexxy"), {"Frontpage", "Dragons"})
+        self.memberships.on_leave({'channel': "Dragons", 'character': "Hexxy"})
+        self.memberships.on_join({'character': {'identity': "Kira"}, 'channel': "Dragons"})
+        self.assertEqual(self.memberships.character_channels("Hexxy"), {"Frontpage"})
+        self.assertEqual(self.memberships.channel_members("Dragons"), {"Adamoraco", "Dragons regular", "Kira"})
+
+    def test_offline_and_own_leave(self):
+        self.memberships.on_offline({'character': "Hexxy"})
+        self.assertNotIn("Hexxy", self.memberships.channels_of)
+        self.assertFalse(self.memberships.is_member("Frontpage", "Hexxy"))
+
+        self.memberships.on_leave({'channel': "Dragons", 'character': "Adamoraco"})
+        self.assertNotIn("Dragons", self.memberships.members)
+        self.assertNotIn("Dragons regular", self.memberships.channels_of, "Nothing is kept for channels we left.")
+        self.assertEqual(self.memberships.character_channels("Adamoraco"), {"Frontpage"})
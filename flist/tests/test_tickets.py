@@ -0,0 +1,87 @@
+import unittest
+import asyncio
+import os
+import tempfile
+from unittest.mock import patch
+
+from flist.account import Account
+from flist.tickets import TicketManager, TicketStore, TICKET_LIFETIME, fcntl
+
+
+class TestTicketManager(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "tickets.json")
+        self.now = 1000.0
+        self.issued = 0
+
+        async def get_ticket(account, password, *, client=None):
+            self.issued += 1
+            return {'ticket': "ticket-%d" % self.issued, 'bookmarks': [], 'friends': [], 'characters': ["Hexxy"]}
+
+        patcher = patch('flist.api.get_ticket', get_ticket)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def store(self):
+        return TicketStore(self.path, clock=lambda: self.now)
+
+    def test_shared_between_processes(self):
+        first = TicketManager("account", "password", self.store())
+        second = TicketManager("account", "password", self.store())
+        self.assertIsNone(first.ticket)
+
+        self.assertEqual(self.loop.run_until_complete(first.get())['ticket'], "ticket-1")
+        self.assertIsNone(second.ticket, "The property does not read the file.")
+        self.assertEqual(self.loop.run_until_complete(second.get())['ticket'], "ticket-1")
+        self.assertEqual(second.ticket, "ticket-1", "The ticket is read from the shared file.")
+        self.assertEqual(self.issued, 1, "Only one process asks the API.")
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        with open(self.path) as f:
+            self.assertNotIn("password", f.read())
+
+    def test_expiry_and_refused_tickets(self):
+        manager = TicketManager("account", "password", self.store())
+        self.loop.run_until_complete(manager.get())
+        self.now += TICKET_LIFETIME - 60 * 60
+        self.assertEqual(manager.ticket, "ticket-1", "The ticket is served until it expires.")
+        self.assertEqual(self.loop.run_until_complete(manager.get())['ticket'], "ticket-2",
+                         "Tickets are replaced ahead of their expiry.")
+        self.now += TICKET_LIFETIME
+        self.assertIsNone(manager.ticket)
+        self.now -= TICKET_LIFETIME
+
+        other = TicketManager("account", "password", self.store())
+        self.loop.run_until_complete(other.get(stale="ticket-2"))
+        self.assertEqual(other.ticket, "ticket-3", "A refused ticket is replaced.")
+        self.loop.run_until_complete(manager.get(stale="ticket-2"))
+        self.assertEqual((manager.ticket, self.issued), ("ticket-3", 3), "Unless another process already did.")
+
+    def test_account_refreshes_ahead_of_expiry(self):
+        account = Account("account", "password", self.store())
+        self.loop.run_until_complete(account.login())
+        self.assertEqual((account.ticket, account.character_names), ("ticket-1", ["Hexxy"]))
+        timer = account.tickets._timer
+        self.assertAlmostEqual(timer.when() - self.loop.time(), TICKET_LIFETIME - 60 * 60, delta=1)
+        account.tickets.close()
+
+        self.loop.run_until_complete(Account("account", "password", self.store()).login())
+        self.assertEqual(self.issued, 1, "Logging in again reuses the stored ticket.")
+
+    @unittest.skipIf(fcntl is None, "The file store is only locked where flock exists.")
+    def test_cancelled_while_waiting_for_the_lock(self):
+        manager = TicketManager("account", "password", self.store())
+        with open(self.path + ".lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # The raised error keeps the frame of the cancelled get alive, as a caller's traceback would.
+            with self.assertRaises(asyncio.TimeoutError) as raised:
+                self.loop.run_until_complete(asyncio.wait_for(manager.get(), 0.05))
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+        other = TicketManager("account", "password", self.store())
+        entry = self.loop.run_until_complete(asyncio.wait_for(other.get(), 2))
+        self.assertEqual(entry['ticket'], "ticket-1", "A cancelled get does not keep the store locked.")
+        self.assertIsNotNone(raised.exception)
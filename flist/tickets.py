@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import flist.api as api
+
+try:
+    import fcntl
+except ImportError:  # Windows, the file store then relies on atomic replaces alone.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Tickets are valid for 24 hours from issue.
+TICKET_LIFETIME = 24 * 60 * 60
+
+
+def default_path():
+    """Per user ticket file shared by the processes of this host."""
+    return os.path.join(os.path.expanduser("~"), ".cache", "flist", "tickets.json")
+
+
+class TicketStore(object):
+    """Tickets with their issue time, kept in memory or in a JSON file shared across processes.
+
+    The file holds the getApiTicket response of each account with the wall clock time it was issued,
+    never the password. Access goes through an exclusive flock on path + '.lock' and writes replace
+    the file atomically. A ticket is valid until it expires, and fresh until margin seconds before that.
+
+    :param path: File to persist tickets in, see default_path; None keeps them in this process only.
+    :param margin: Seconds before the expiry at which a ticket is replaced.
+    """
+
+    def __init__(self, path=None, lifetime=TICKET_LIFETIME, margin=60 * 60, clock=time.time):
+        self.path = path
+        self.lifetime = lifetime
+        self.margin = margin
+        self.clock = clock
+        self.entries = {}
+
+    def refresh_at(self, entry):
+        return entry['issued'] + self.lifetime - self.margin
+
+    def fresh(self, entry):
+        return entry is not None and self.clock() < self.refresh_at(entry)
+
+    def valid(self, entry):
+        return entry is not None and self.clock() < entry['issued'] + self.lifetime
+
+    @contextmanager
+    def locked(self):
+        """Hold the store for a read-modify-write, other processes wait until it is released."""
+        if self.path is None or fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self):
+        if self.path is None:
+            return self.entries
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logger.warning("Ignoring unreadable ticket file %s.", self.path)
+            return {}
+
+    def _write(self, entries):
+        if self.path is None:
+            self.entries = entries
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix=".tickets")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            os.chmod(temporary, 0o600)
+            os.replace(temporary, self.path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def load(self, account):
+        """The stored entry of the account, None when there is none.
+        Call within locked() when the result decides a write."""
+        return self._read().get(account)
+
+    def save(self, account, data):
+        """Store a getApiTicket response as issued now, call within locked()."""
+        entry = dict(data, issued=self.clock())
+        entries = self._read()
+        entries[account] = entry
+        self._write(entries)
+        return entry
+
+
+class TicketManager(object):
+    """Serves the ticket of an account, asking the API only when there is no fresh one.
+
+    The ticket property answers from memory, returning the last ticket until it expires; get() reads the
+    store and replaces a ticket which is no longer fresh. It takes the store lock before fetching, so processes sharing a store file never fetch concurrently and so
+    never invalidate each other's tickets. Once start() was called the ticket is replaced shortly
+    before it expires.
+
+    :param store: TicketStore, defaults to one which only lives in this process.
+    :param client: flist.api.APIClient used for getApiTicket.
+    """
+
+    def __init__(self, account, password, store=None, client=None):
+        self.account = account
+        self.password = password
+        self.store = store or TicketStore()
+        self.client = client
+        self.entry = None
+        self.fetched = 0
+        self._lock = None
+        self._timer = None
+
+    @property
+    def ticket(self):
+        entry = self.entry
+        return entry['ticket'] if self.store.valid(entry) else None
+
+    def current(self):
+        """Fresh entry from memory or the store, None when a fetch is needed."""
+        if not self.store.fresh(self.entry):
+            entry = self.store.load(self.account)
+            self.entry = entry if self.store.fresh(entry) else None
+        return self.entry
+
+    def _usable(self, entry, stale):
+        return self.store.fresh(entry) and entry['ticket'] != stale
+
+    async def get(self, stale=None):
+        """Fresh getApiTicket response, fetching a new ticket when needed.
+        :param stale: A ticket the server refused, it is replaced even though it has not expired.
+        """
+        entry = self.current()
+        if self._usable(entry, stale):
+            return entry
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            loop = asyncio.get_event_loop()
+            lock = self.store.locked()
+            await self._acquire(loop, lock)
+            try:
+                entry = self.store.load(self.account)
+                if not self._usable(entry, stale):
+                    entry = await self._fetch()
+            finally:
+                lock.__exit__(None, None, None)
+            self.entry = entry
+        if self._timer is not None:
+            self.start()
+        return entry
+
+    @staticmethod
+    async def _acquire(loop, lock):
+        acquiring = loop.run_in_executor(None, lock.__enter__)
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # The executor thread still takes the lock, release it as soon as it has.
+            def release(f):
+                if not f.cancelled() and f.exception() is None:
+                    lock.__exit__(None, None, None)
+
+            acquiring.add_done_callback(release)
+            raise
+
+    async def _fetch(self):
+        data = await api.get_ticket(self.account, self.password, client=self.client)
+        if data.get('error'):
+            raise ConnectionRefusedError(data['error'])
+        self.fetched += 1
+        return self.store.save(self.account, data)
+
+    def start(self):
+        """Replace the ticket shortly before it expires, from now on."""
+        self.close()
+        loop = asyncio.get_event_loop()
+        delay = self.store.refresh_at(self.entry) - self.store.clock() if self.entry else 0
+        self._timer = loop.call_later(max(0, delay), self._refresh)
+
+    def _refresh(self):
+        def done(f):
+            if not f.cancelled() and f.exception() is not None:
+                logger.error("Refreshing the ticket of %s failed.", self.account, exc_info=f.exception())
+                self._timer = asyncio.get_event_loop().call_later(60, self._refresh)
+
+        asyncio.ensure_future(self.get()).add_done_callback(done)
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
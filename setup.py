@@ -29,6 +29,9 @@ setup(name='Python-flist',
           "Topic :: Software Development :: Libraries :: Python Modules",
       ],
       install_requires=requirements,
+      extras_require={
+          'fast': ["orjson"],
+      },
       provides=[
           'flist',
       ],